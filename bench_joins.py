@@ -0,0 +1,338 @@
+"""
+Join benchmark suite.
+
+Generates synthetic master/reference datasets and times get_columns,
+get_multi_preview and execute_multi_join over a grid of scenarios (master rows,
+reference count, key cardinality and skew, duplicate-key rate, column width,
+input format). Every measurement runs in a fresh interpreter with empty staging
+and result caches, so CSV/XLSX staging is part of the cost, as on first use.
+
+Data is a pure function of the scenario and --seed (integer hashing in SQL, no
+RNG), so two checkouts benchmark identical inputs. Each run appends one JSON line
+to the results file with timings, rows/sec, peak RSS and peak temp-disk usage,
+tagged with the git commit, DuckDB version and host; --compare prints the median
+change per scenario against an earlier results file.
+
+    python bench_joins.py --rows 100000,1000000 --refs 1,3 --formats csv,parquet --repeat 3
+    python bench_joins.py --skew 0,1.5 --dup-rate 0,0.2 --results results/bench_new.jsonl \\
+        --compare results/bench_base.jsonl
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Bump when generated data changes so results from different generators are not compared
+GENERATOR_VERSION = 1
+PHASES = ("get_columns", "get_multi_preview", "execute_multi_join")
+XLSX_MAX_ROWS = 1_048_575
+# Knuth multiplicative hashing: a uniform value in [0, 1) per (row, column salt)
+_UNIFORM = "((({i}) * 2654435761 + {salt} * 40503 + {seed} * 97) % 4294967296) / 4294967296.0"
+
+def _uniform(i: str, salt: int, seed: int) -> str:
+    return _UNIFORM.format(i=i, salt=salt, seed=seed)
+
+def scenario_id(scenario: Dict) -> str:
+    spec = json.dumps({**scenario, "generator": GENERATOR_VERSION}, sort_keys=True)
+    return hashlib.sha1(spec.encode("utf-8")).hexdigest()[:12]
+
+# --- data generation ---
+
+def _master_sql(s: Dict) -> str:
+    # key = floor(cardinality * u^(1 + skew)): skew 0 is uniform, larger values favour low keys
+    cols = ["i AS id"]
+    for j in range(s["refs"]):
+        u = _uniform("i", 11 + j, s["seed"])
+        cols.append(f"CAST(floor({s['cardinality']} * pow({u}, {1 + s['skew']})) AS BIGINT) AS k{j}")
+    for n in range(s["width"]):
+        cols.append(f"'m' || CAST(floor({_uniform('i', 101 + n, s['seed'])} * 100000) AS BIGINT) AS c{n}")
+    return f"SELECT {', '.join(cols)} FROM range({s['rows']}) t(i)"
+
+def _reference_sql(s: Dict, j: int) -> str:
+    # Every key once, then the first dup_rate * cardinality keys a second time
+    total = int(s["cardinality"] * (1 + s["dup_rate"]))
+    cols = [f"i % {s['cardinality']} AS key"]
+    for n in range(s["width"]):
+        cols.append(f"'r{j}_' || CAST(floor({_uniform('i', 1001 + 100 * j + n, s['seed'])} * 100000) AS BIGINT) AS a{n}")
+    return f"SELECT {', '.join(cols)} FROM range({total}) t(i)"
+
+def _write(con, query: str, path: str, fmt: str):
+    if fmt == "parquet":
+        con.execute(f"COPY ({query}) TO '{path}' (FORMAT PARQUET)")
+    elif fmt == "csv":
+        con.execute(f"COPY ({query}) TO '{path}' (FORMAT CSV, HEADER)")
+    elif fmt == "xlsx":
+        from openpyxl import Workbook # type: ignore
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("data")
+        result = con.execute(query)
+        ws.append([d[0] for d in result.description])
+        while True:
+            rows = result.fetchmany(50_000)
+            if not rows:
+                break
+            for row in rows:
+                ws.append(row)
+        wb.save(path)
+    else:
+        raise ValueError(f"Unsupported format '{fmt}'")
+
+def generate_dataset(data_dir: str, scenario: Dict) -> Dict[str, object]:
+    """Writes (or reuses) the scenario's master and reference files; returns their paths."""
+    import duckdb # type: ignore
+    fmt = scenario["format"]
+    target = os.path.join(os.path.abspath(data_dir), f"data_{scenario_id(scenario)}")
+    paths = {"master": os.path.join(target, f"master.{fmt}"),
+             "references": [os.path.join(target, f"r{j}.{fmt}") for j in range(scenario["refs"])]}
+    marker = os.path.join(target, "done.json")
+    if os.path.exists(marker):
+        return paths
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target)
+    con = duckdb.connect()
+    try:
+        _write(con, _master_sql(scenario), paths["master"], fmt)
+        for j, path in enumerate(paths["references"]):
+            _write(con, _reference_sql(scenario, j), path, fmt)
+    finally:
+        con.close()
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(scenario, f, indent=2)
+    return paths
+
+# --- measurement (child process) ---
+
+def _peak_rss() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class _DiskSampler:
+    """Polls a directory's size in the background and keeps the peak."""
+    def __init__(self, path: str, interval: float = 0.05):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    def _poll(self):
+        from utils import get_path_size # type: ignore
+        while not self._stop.is_set():
+            self.peak = max(self.peak, get_path_size(self.path))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def measure(task: Dict) -> Dict:
+    """Runs the three phases once on a fresh engine and returns the measurements."""
+    from engine import LookupEngine # type: ignore
+    from utils import get_path_size # type: ignore
+    scenario, paths, scratch = task["scenario"], task["paths"], task["scratch"]
+    temp_root = os.path.join(scratch, "temp")
+    cache_dir = os.path.join(scratch, "cache")
+    os.makedirs(temp_root, exist_ok=True)
+    engine = LookupEngine(temp_dir=temp_root, cache_dir=cache_dir,
+                          threads=task.get("threads"), memory_limit=task.get("memory_limit"))
+    refs = [{"path": path, "match_pairs": [(f"k{j}", "key")], "pull_cols": [f"a{n}" for n in range(scenario["width"])],
+             "match_policy": scenario["policy"]} for j, path in enumerate(paths["references"])]
+    output_path = os.path.join(scratch, f"out.{task['output_format']}")
+    timings: Dict[str, float] = {}
+    rss: Dict[str, Optional[int]] = {}
+    try:
+        with _DiskSampler(temp_root) as disk:
+            start = time.perf_counter()
+            for path in [paths["master"]] + paths["references"]:
+                if not engine.get_columns(path):
+                    raise RuntimeError(f"No columns read from {path}")
+            timings["get_columns"] = time.perf_counter() - start
+            rss["get_columns"] = _peak_rss()
+
+            start = time.perf_counter()
+            engine.get_multi_preview(paths["master"], refs, limit=10)
+            timings["get_multi_preview"] = time.perf_counter() - start
+            rss["get_multi_preview"] = _peak_rss()
+
+            start = time.perf_counter()
+            ok, msg = engine.execute_multi_join(paths["master"], refs, output_path, task["output_format"],
+                                                use_cache=False, partitions=task.get("partitions", 0))
+            timings["execute_multi_join"] = time.perf_counter() - start
+            rss["execute_multi_join"] = _peak_rss()
+            if not ok:
+                raise RuntimeError(msg)
+        output_rows = (getattr(engine, "last_match_stats", None) or {}).get("rows")
+        return {
+            "seconds": timings,
+            "rows_per_sec": scenario["rows"] / timings["execute_multi_join"] if timings["execute_multi_join"] else None,
+            "output_rows": output_rows,
+            "peak_rss_bytes": rss,
+            "peak_temp_bytes": disk.peak,
+            "staging_bytes": get_path_size(cache_dir),
+            "output_bytes": get_path_size(output_path),
+        }
+    finally:
+        engine.cleanup()
+
+# --- driver ---
+
+def _git_revision(here: str) -> Dict[str, object]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=here, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+def environment(here: str) -> Dict[str, object]:
+    import duckdb # type: ignore
+    from utils import get_total_memory # type: ignore
+    return {**_git_revision(here), "duckdb": duckdb.__version__, "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(), "memory_bytes": get_total_memory()}
+
+def run_isolated(task: Dict, here: str) -> Dict:
+    """Measures one task in a fresh interpreter (clean caches, per-run peak RSS)."""
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", json.dumps(task)],
+                         cwd=here, capture_output=True, text=True)
+    lines = out.stdout.strip().splitlines()
+    if out.returncode != 0 or not lines:
+        return {"error": (out.stderr.strip().splitlines() or ["unknown error"])[-1]}
+    return json.loads(lines[-1])
+
+def scenarios(args) -> List[Dict]:
+    grid = itertools.product(_ints(args.rows), _ints(args.refs), _ints(args.cardinality), _floats(args.skew),
+                             _floats(args.dup_rate), _ints(args.width), args.formats.split(","))
+    result = []
+    for rows, refs, cardinality, skew, dup_rate, width, fmt in grid:
+        if fmt == "xlsx" and max(rows, int(cardinality * (1 + dup_rate))) > XLSX_MAX_ROWS:
+            print(f"Skipping xlsx with {rows:,} rows: over the sheet row limit")
+            continue
+        result.append({"rows": rows, "refs": refs, "cardinality": cardinality, "skew": skew, "dup_rate": dup_rate,
+                       "width": width, "format": fmt, "policy": args.policy, "seed": args.seed})
+    return result
+
+def _ints(text: str) -> List[int]:
+    return [int(float(v)) for v in text.split(",")]
+
+def _floats(text: str) -> List[float]:
+    return [float(v) for v in text.split(",")]
+
+def _label(s: Dict) -> str:
+    return (f"{s['format']:<7} rows={s['rows']:<9,} refs={s['refs']} card={s['cardinality']:<9,} "
+            f"skew={s['skew']:g} dup={s['dup_rate']:g} width={s['width']}")
+
+def load_results(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _run_key(record: Dict) -> str:
+    """Dataset plus run settings: only runs that agree on both are compared."""
+    return "|".join(str(record.get(k)) for k in ("scenario_id", "output_format", "partitions", "threads", "memory_limit"))
+
+def _medians(records: List[Dict]) -> Dict[str, Dict[str, float]]:
+    grouped: Dict[str, Dict[str, List[float]]] = {}
+    for r in records:
+        if "error" in r:
+            continue
+        phases = grouped.setdefault(_run_key(r), {})
+        for phase, seconds in r["seconds"].items():
+            phases.setdefault(phase, []).append(seconds)
+    return {sid: {p: sorted(v)[len(v) // 2] for p, v in phases.items()} for sid, phases in grouped.items()}
+
+def compare(baseline: List[Dict], current: List[Dict]):
+    """Prints the median time per phase of every scenario present in both result sets."""
+    base, cur = _medians(baseline), _medians(current)
+    labels = {_run_key(r): _label(r["scenario"]) for r in current}
+    for key in [k for k in cur if k in base]:
+        print(labels[key])
+        for phase in PHASES:
+            if phase in base[key] and phase in cur[key]:
+                ratio = cur[key][phase] / base[key][phase] if base[key][phase] else float("inf")
+                print(f"  {phase:<20}{base[key][phase]:9.3f}s -> {cur[key][phase]:9.3f}s  x{ratio:.2f}")
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Synthetic-data join benchmarks for the lookup engine.")
+    parser.add_argument("--rows", default="100000", help="Master row counts (comma-separated)")
+    parser.add_argument("--refs", default="1", help="Reference counts")
+    parser.add_argument("--cardinality", default="10000", help="Distinct keys per reference")
+    parser.add_argument("--skew", default="0", help="Master key skew exponent (0 = uniform)")
+    parser.add_argument("--dup-rate", default="0", help="Share of reference keys repeated once")
+    parser.add_argument("--width", default="4", help="Payload columns in the master and each reference")
+    parser.add_argument("--formats", default="parquet", help="Input formats: csv, parquet, xlsx")
+    parser.add_argument("--policy", default="all", help="Match policy for every reference")
+    parser.add_argument("--output-format", default="parquet", choices=["csv", "parquet"])
+    parser.add_argument("--partitions", type=int, default=0, help="Run joins out of core in N buckets")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--memory-limit", default=None)
+    parser.add_argument("--repeat", type=int, default=1, help="Fresh-process runs per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=os.path.join("results", "bench_data"),
+                        help="Generated datasets (reused across runs)")
+    parser.add_argument("--results", default=os.path.join("results", "bench_joins.jsonl"),
+                        help="JSON-lines file the runs are appended to")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--measure", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(measure(json.loads(args.measure))))
+        return 0
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = environment(here)
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    failures = 0
+    for scenario in scenarios(args):
+        sid = scenario_id(scenario)
+        start = time.perf_counter()
+        paths = generate_dataset(args.data_dir, scenario)
+        print(f"{_label(scenario)}  [{sid}] data ready in {time.perf_counter() - start:.1f}s")
+        for n in range(max(1, args.repeat)):
+            scratch = tempfile.mkdtemp(prefix="bench_")
+            try:
+                task = {"scenario": scenario, "paths": paths, "scratch": scratch, "output_format": args.output_format,
+                        "partitions": args.partitions, "threads": args.threads, "memory_limit": args.memory_limit}
+                result = run_isolated(task, here)
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+            record = {"scenario_id": sid, "scenario": scenario, "repeat": n, "output_format": args.output_format,
+                      "partitions": args.partitions, "threads": args.threads, "memory_limit": args.memory_limit,
+                      "environment": env, "timestamp": time.time(), **result}
+            with open(args.results, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            if "error" in result:
+                failures += 1
+                print(f"  run {n}: FAILED {result['error']}")
+                continue
+            secs = result["seconds"]
+            rss = result["peak_rss_bytes"]["execute_multi_join"]
+            print(f"  run {n}: columns {secs['get_columns']:.3f}s  preview {secs['get_multi_preview']:.3f}s  "
+                  f"join {secs['execute_multi_join']:.3f}s  {result['rows_per_sec']:,.0f} rows/s  "
+                  f"rss {(rss or 0) / 2**20:,.0f} MiB  temp {result['peak_temp_bytes'] / 2**20:,.1f} MiB")
+
+    if args.compare:
+        compare(load_results(args.compare), load_results(args.results))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Startup timing benchmark.
+
+Measures, in a fresh interpreter, what a cold app start and a new session cost:
+importing the app modules, building the engine pool and handing out a session
+engine. Fails (exit code 1) when a budget is exceeded or when startup pulls in
+work that should be deferred (pandas import, spatial extension load).
+
+    python bench_startup.py --runs 5 --max-cold 1.0 --max-session 0.05
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import engine, pool, store, keys, profiling, matchstats, utils
+t1 = time.perf_counter()
+p = pool.EnginePool(temp_root=sys.argv[1], cache_dir=sys.argv[2], max_jobs=1)
+t2 = time.perf_counter()
+session = p.session_engine()
+t3 = time.perf_counter()
+loaded = [r[0] for r in session.con.execute(
+    "SELECT extension_name FROM duckdb_extensions() WHERE loaded").fetchall()]
+print(json.dumps({
+    "imports": t1 - t0,
+    "pool": t2 - t1,
+    "session": t3 - t2,
+    "cold_start": t3 - t0,
+    "pandas_imported": "pandas" in sys.modules,
+    "spatial_loaded": "spatial" in loaded,
+}))
+p.shutdown()
+"""
+
+def run_probe() -> Dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as scratch:
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE, os.path.join(scratch, "temp"), os.path.join(scratch, "cache")],
+            cwd=here, capture_output=True, text=True, check=True,
+        )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Cold start / new session timing for the lookup engine.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to time (median is reported)")
+    parser.add_argument("--max-cold", type=float, default=None, help="Fail if median cold start exceeds this (s)")
+    parser.add_argument("--max-session", type=float, default=None, help="Fail if median new-session time exceeds this (s)")
+    args = parser.parse_args(argv)
+
+    samples = [run_probe() for _ in range(max(1, args.runs))]
+    median = {}
+    for key in ("imports", "pool", "session", "cold_start"):
+        values = sorted(s[key] for s in samples)
+        median[key] = values[len(values) // 2]
+    for key, value in median.items():
+        print(f"{key:<12}{value * 1000:9.1f} ms")
+
+    failures = []
+    if any(s["pandas_imported"] for s in samples):
+        failures.append("pandas imported at startup")
+    if any(s["spatial_loaded"] for s in samples):
+        failures.append("spatial extension loaded at startup")
+    if args.max_cold is not None and median["cold_start"] > args.max_cold:
+        failures.append(f"cold start {median['cold_start']:.3f}s > {args.max_cold}s")
+    if args.max_session is not None and median["session"] > args.max_session:
+        failures.append(f"new session {median['session']:.3f}s > {args.max_session}s")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
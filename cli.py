@@ -0,0 +1,167 @@
+"""
+Headless batch runner for chain-join enrichment jobs.
+
+Job file (JSON):
+{
+  "defaults": {"format": "csv", "threads": 2, "memory_limit": "4GB"},
+  "jobs": [
+    {
+      "name": "customers",
+      "master": "data/master.csv",
+      "references": [
+        {"path": "data/registry.parquet", "match_pairs": [["id", "reg_id"]], "pull_cols": ["email"]}
+      ],
+      "output": "results/customers",
+      "format": "parquet",
+      "master_cols": ["id", "name"],
+      "write_options": {"compression": "zstd", "row_group_size": 122880, "partition_by": ["country"]}
+    }
+  ]
+}
+
+Match statistics (<output>.stats.json) are collected by default; set "collect_stats": false
+to skip them and write through a plain COPY, which is faster on large outputs.
+Outputs written as a directory of files (partition_by, per_thread_output, file_size_bytes,
+rows_per_file) need an empty or new "output" directory; a non-empty one fails the job.
+Set "profile": true on a job to save a <output>.report.json run breakdown
+(partitioned jobs report every bucket join, tagged with its bucket).
+Set "partitions": N (and optionally "partition_workers") to join references larger than
+memory out of core, N hash buckets at a time (single-file outputs only).
+A reference can set "match_type": "asof" with "time_col" (master) and "valid_from"
+(registry) to take the latest registry row at or before the master timestamp, or
+"interval" with "valid_to" as well to take the row whose [valid_from, valid_to) contains it.
+Intervals of one key must not overlap: "interval" checks only the row with the latest
+valid_from, and overlapping intervals are reported as key warnings.
+Incremental jobs set "incremental": true (and optionally "watermark_column") and
+write new output parts into the "output" directory on each run.
+
+Usage: python cli.py jobs.json --workers 4 --summary results/batch_summary.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from utils import MEMORY_FRACTION, format_bytes, get_path_size, get_total_memory, validate_path
+
+def load_jobs(job_file: str) -> List[Dict]:
+    """Reads a job file and applies its defaults to every job."""
+    with open(job_file, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+    defaults = spec.get("defaults", {})
+    jobs = []
+    for i, job in enumerate(spec.get("jobs", [])):
+        merged = {**defaults, **job}
+        merged.setdefault("name", f"job_{i}")
+        merged.setdefault("format", "csv")
+        for key in ("master", "references", "output"):
+            if key not in merged:
+                raise ValueError(f"Job '{merged['name']}' is missing '{key}'")
+        jobs.append(merged)
+    return jobs
+
+def run_job(job: Dict, temp_root: str, threads: int, memory_limit: str,
+            registry_path: Optional[str] = None) -> Dict:
+    """Runs one job in a worker process with its own engine, temp dir and resource budget."""
+    from engine import LookupEngine # type: ignore
+    from incremental import IncrementalRunner # type: ignore
+
+    start = time.time()
+    engine = LookupEngine(
+        temp_dir=os.path.join(temp_root, job["name"]),
+        threads=job.get("threads") or threads,
+        memory_limit=job.get("memory_limit") or memory_limit,
+        registry_path=job.get("registry") or registry_path,
+    )
+    try:
+        validate_path(job["output"])
+        if job.get("incremental"):
+            # Output is a directory of parts plus its watermark
+            success, msg = IncrementalRunner(engine).run(
+                job["master"], job["references"], job["output"], job["format"],
+                watermark_column=job.get("watermark_column"),
+                master_cols=job.get("master_cols"),
+            )
+        else:
+            success, msg = engine.execute_multi_join(
+                job["master"], job["references"], job["output"], job["format"],
+                master_cols=job.get("master_cols"),
+                write_options=job.get("write_options"),
+                profile=bool(job.get("profile")),
+                collect_stats=bool(job.get("collect_stats", True)),
+                partitions=int(job.get("partitions") or 0),
+                partition_workers=int(job.get("partition_workers") or 1),
+            )
+    except Exception as e:
+        success, msg = False, str(e)
+    finally:
+        engine.cleanup()
+    elapsed = time.time() - start
+    size = get_path_size(job["output"]) if success else 0
+    return {"name": job["name"], "success": success, "message": msg, "elapsed": elapsed,
+            "output": job["output"], "output_bytes": size}
+
+def run_batch(jobs: List[Dict], workers: int, temp_root: str = "duckdb_batch",
+              memory_limit: str = "", registry_path: Optional[str] = None) -> List[Dict]:
+    """Runs jobs concurrently, splitting the machine's threads and memory across workers."""
+    workers = max(1, min(workers, len(jobs) or 1))
+    if workers > 1 and (registry_path or any(job.get("registry") for job in jobs)):
+        # A registry database file can only be opened by one process at a time
+        print("Registry database in use: running jobs one at a time.")
+        workers = 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if not memory_limit:
+        # DuckDB's default (80% of RAM) per process would oversubscribe memory N times
+        total_memory = get_total_memory()
+        if total_memory:
+            memory_limit = f"{int(total_memory * MEMORY_FRACTION) // workers // 2**20}MB"
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_job, job, temp_root, threads, memory_limit, registry_path): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"name": job["name"], "success": False, "message": str(e), "elapsed": 0.0,
+                          "output": job["output"], "output_bytes": 0}
+            status = "OK  " if result["success"] else "FAIL"
+            print(f"[{status}] {result['name']} ({result['elapsed']:.2f}s) {result['message']}")
+            results.append(result)
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run chain-join enrichment jobs without the UI.")
+    parser.add_argument("job_file", help="JSON job file")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Number of jobs to run concurrently")
+    parser.add_argument("--memory-limit", default="",
+                        help="DuckDB memory_limit per job, e.g. 4GB (default: 80%% of RAM split across workers)")
+    parser.add_argument("--temp-root", default="duckdb_batch", help="Parent directory for per-job temp dirs")
+    parser.add_argument("--registry", default=None,
+                        help="Persistent reference registry database (jobs then run one at a time; "
+                             "DuckDB files take a process lock)")
+    parser.add_argument("--summary", default="batch_summary.json", help="Where to write the timing summary")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.job_file)
+    batch_start = time.time()
+    results = run_batch(jobs, args.workers, args.temp_root, args.memory_limit, args.registry)
+    total = time.time() - batch_start
+
+    summary = {"total_elapsed": total, "workers": args.workers, "jobs": results}
+    validate_path(args.summary)
+    with open(args.summary, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"\n{'JOB':<30} {'STATUS':<8} {'TIME':>10} {'OUTPUT':>12}")
+    for r in sorted(results, key=lambda r: r["name"]):
+        status = "ok" if r["success"] else "failed"
+        print(f"{r['name']:<30} {status:<8} {r['elapsed']:>9.2f}s {format_bytes(r['output_bytes']):>12}")
+    print(f"Total: {total:.2f}s -> {args.summary}")
+    return 0 if all(r["success"] for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
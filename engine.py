@@ -1,57 +1,285 @@
 import duckdb # type: ignore
 import os
+import re
 import shutil
-from typing import List, Tuple, Dict
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, List, Tuple, Dict, Optional, Union
+from staging import StagingCache # type: ignore
+from excel import ExcelIngestor, list_sheets # type: ignore
+from registry import ReferenceRegistry # type: ignore
+from utils import dataset_files, get_file_fingerprint, get_path_size, is_dataset, is_multi_file_output, source_format
+from planner import JoinPlanner # type: ignore
+from partitioned import PartitionedJoin # type: ignore
+from memo import ResultCache # type: ignore
+from profiling import build_partitioned_report, build_run_report, enable_profiling, load_profile, save_run_report # type: ignore
+from matchstats import MATCH_FLAG, MatchStats, flag_column # type: ignore
+from keys import common_type, key_expr, key_type_warnings, transforms_for, type_family # type: ignore
+
+# Source paths with this prefix name inputs registered via LookupEngine.register_source
+MEMORY_PREFIX = "memory://"
+
+def _literal(value: Any, duck_type: str) -> str:
+    """SQL literal of a Python value as the given DuckDB type."""
+    text = str(value).replace("'", "''")
+    return f"CAST('{text}' AS {duck_type})"
+
+# The reference pre-filter runs only when master rows <= this share of reference rows; above
+# it DuckDB's own join filters already skip most non-matching reference data and the extra
+# master scan and hash make the join slower
+PREFILTER_MAX_RATIO = 0.01
+
+# DuckDB COPY codec names -> pyarrow Parquet writer names
+PARQUET_CODECS = {'uncompressed': 'none', 'lz4_raw': 'lz4'}
+
+# Per-reference handling of duplicate registry keys (ref['match_policy'])
+MATCH_POLICIES = ('all', 'first', 'latest', 'list', 'count')
+
+# Per-reference match type (ref['match_type']): equality on match_pairs, or additionally
+# 'asof' (latest row with valid_from <= master time_col) / 'interval' (valid_from <= time < valid_to).
+# 'interval' assumes a key's intervals do not overlap: it takes the ASOF row (latest valid_from)
+# and masks it when valid_to has passed, so an earlier, longer interval is never used instead.
+# check_intervals warns about references that break this.
+MATCH_TYPES = ('equal', 'asof', 'interval')
 
 class LookupEngine:
     """
     High-Performance Lookup Engine using DuckDB for out-of-core processing.
     Supports Multi-File Chain Joining (Data Enrichment).
     """
-    def __init__(self, temp_dir: str = "duckdb_temp"):
-        self.temp_dir = temp_dir
-        if os.path.exists(self.temp_dir):
-            try:
-                shutil.rmtree(self.temp_dir)
-            except:
-                pass
-        if not os.path.exists(self.temp_dir):
-            os.makedirs(self.temp_dir)
-        
-        # Initialize connection
-        self.con = duckdb.connect(database=':memory:')
+    def __init__(self,
+                 temp_dir: str = "duckdb_temp",
+                 cache_dir: Optional[str] = "duckdb_cache",
+                 cache_max_bytes: int = 20 * 2**30,
+                 threads: Optional[int] = None,
+                 memory_limit: Optional[str] = None,
+                 registry_path: Optional[str] = None,
+                 lookup_cache_size: int = 100_000,
+                 con=None,
+                 staging: Optional[StagingCache] = None,
+                 extension_dir: Optional[str] = None,
+                 result_cache: Optional[ResultCache] = None):
+        """
+        Without con, the engine owns a fresh DuckDB instance whose spill files go to its
+        own subdirectory of temp_dir (other engines' temp files are never touched).
+        With con (a cursor from EnginePool), it shares that instance's settings, temp
+        directory, extensions and the given staging cache.
+        Extensions (spatial for Excel) are loaded on first use; extension_dir (or the
+        LOOKUP_EXTENSION_DIR environment variable) points at pre-downloaded
+        <name>.duckdb_extension files and disables network installs.
+        """
+        self.extension_dir = extension_dir or os.environ.get("LOOKUP_EXTENSION_DIR")
+        self.loaded_extensions: set = set()
+
+        self.owns_connection = con is None
+        if self.owns_connection:
+            self.temp_dir = os.path.join(temp_dir, f"engine_{os.getpid()}_{uuid.uuid4().hex[:8]}")
+            os.makedirs(self.temp_dir, exist_ok=True)
+            
+            # Initialize connection (on-disk when a persistent reference registry is used)
+            self.con = duckdb.connect(database=registry_path or ':memory:')
+            if self.extension_dir:
+                # Air-gapped hosts: never reach for the network when resolving extensions
+                self.con.execute(f"SET extension_directory='{self.extension_dir}'")
+                self.con.execute("SET autoinstall_known_extensions=false")
+
+            self.con.execute(f"SET temp_directory='{self.temp_dir}'")
+            self.con.execute("SET preserve_insertion_order=false")
+            # Optional per-engine resource budget (e.g. for parallel batch jobs)
+            if threads:
+                self.con.execute(f"SET threads={int(threads)}")
+            if memory_limit:
+                self.con.execute(f"SET memory_limit='{memory_limit}'")
+        else:
+            self.temp_dir = temp_dir
+            self.con = con
+        # Track progress for query_progress() without printing a console bar
+        self.con.execute("SET enable_progress_bar=true")
+        self.con.execute("SET enable_progress_bar_print=false")
+
+        # In-memory inputs registered with register_source (name -> view)
+        self.memory_sources: Dict[str, str] = {}
+        self.memory_bytes: Dict[str, int] = {}
+
+        # Parquet staging cache for raw CSV/XLSX inputs (None disables it)
+        if staging is not None:
+            self.staging = staging
+        else:
+            self.staging = StagingCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+        # Memoized previews / outputs keyed by join spec and input fingerprints
+        if result_cache is not None:
+            self.results = result_cache
+        else:
+            self.results = ResultCache(os.path.join(cache_dir, "results")) if cache_dir else None
+
+        # Persistent registry: references are loaded once into sorted tables
+        self.registry = ReferenceRegistry(self.con) if registry_path else None
+
+        # Resident keyed tables and LRU result cache for point/batch lookups
+        self._lookup_tables: Dict[Tuple, Dict] = {}
+        self._lookup_cache: "OrderedDict[Tuple, Optional[Dict]]" = OrderedDict()
+        self.lookup_cache_size = lookup_cache_size
+        self.lookup_hits = 0
+        self.lookup_misses = 0
+        # Overlapping-interval counts per (reference fingerprint, key and validity columns)
+        self._interval_overlap_counts: Dict[Tuple, int] = {}
+
+        # Printable description of the most recent join plan
+        self.last_plan = ""
+        # Structured report of the most recent profiled run
+        self.last_report: Dict = {}
+        # Match counts / null rates of the most recent run
+        self.last_match_stats: Dict = {}
+        # Bucket progress of the current/most recent partitioned run
+        self.partitioned: Optional[PartitionedJoin] = None
         
-        # Load extensions
-        try:
-            self.con.execute("LOAD spatial;")
-        except Exception:
+    def register_source(self, name: str, data) -> str:
+        """
+        Registers an in-memory pyarrow Table / Dataset / RecordBatchReader or pandas DataFrame,
+        which DuckDB scans in place (no copy), and returns a source path usable as file_a or as
+        a reference 'path'. A RecordBatchReader can only be scanned once, while a join scans
+        its inputs several times (planning, key ranges), so prefer Tables. Registrations belong to this engine's connection (not background jobs).
+        """
+        view = f"__mem_{name}"
+        self.con.register(view, data)
+        self.memory_sources[name] = view
+        if hasattr(data, "nbytes"):
+            self.memory_bytes[name] = int(data.nbytes)
+        elif hasattr(data, "memory_usage"):
+            self.memory_bytes[name] = int(data.memory_usage(index=False).sum())
+        return MEMORY_PREFIX + name
+
+    def unregister_source(self, name: str):
+        view = self.memory_sources.pop(name, None)
+        self.memory_bytes.pop(name, None)
+        if view:
+            self.con.unregister(view)
+
+    def _source_exists(self, file_path: str) -> bool:
+        if not file_path:
+            return False
+        if file_path.startswith(MEMORY_PREFIX):
+            return file_path[len(MEMORY_PREFIX):] in self.memory_sources
+        return bool(dataset_files(file_path))
+
+    def source_bytes(self, file_path: str) -> int:
+        """Size of a source file, or the in-memory footprint of a registered source."""
+        if file_path.startswith(MEMORY_PREFIX):
+            return self.memory_bytes.get(file_path[len(MEMORY_PREFIX):], 0)
+        return sum(os.path.getsize(f) for f in dataset_files(file_path))
+
+    def _memory_view(self, file_path: str) -> str:
+        name = file_path[len(MEMORY_PREFIX):]
+        if name not in self.memory_sources:
+            raise ValueError(f"In-memory source '{name}' is not registered")
+        return f"\"{self.memory_sources[name]}\""
+
+    def _read_func(self, file_path: str) -> str:
+        """
+        Returns the DuckDB read expression for a file.
+        Non-Parquet inputs are staged to Parquet once and read from the cache afterwards.
+        """
+        if not file_path:
+            return ""
+        if file_path.startswith(MEMORY_PREFIX):
+            return self._memory_view(file_path)
+        ext, _ = source_format(file_path)
+        if ext == '.xlsx' and not is_dataset(file_path) and self.staging is not None:
+            try:
+                staged = self.ingest_excel(file_path)
+                if staged:
+                    return f"read_parquet('{staged}')"
+            except ImportError:
+                pass  # openpyxl not installed: fall back to spatial.st_read
+        if ext != '.parquet' and self.staging is not None:
+            staged = self.staging.stage(self.con, file_path, lambda: self._raw_read_func(file_path))
+            if staged:
+                return f"read_parquet('{staged}')"
+        return self._raw_read_func(file_path)
+
+    def _ref_read_func(self, ref: Dict) -> str:
+        """Read expression for a reference, served from the persistent registry when enabled."""
+        if self.registry is not None:
             try:
-                self.con.execute("INSTALL spatial; LOAD spatial;")
+                table = self.registry.ensure(ref['path'], [p[1] for p in ref['match_pairs']],
+                                             lambda: self._read_func(ref['path']))
+                if table:
+                    return table
             except Exception as e:
-                print(f"Extension install warning: {e}")
+                print(f"Registry warning: {e}")
+        return self._read_func(ref['path'])
 
-        self.con.execute(f"SET temp_directory='{self.temp_dir}'")
-        self.con.execute("SET preserve_insertion_order=false")
-        
-    def _read_func(self, file_path: str) -> str:
-        """Determines the correct DuckDB read function based on file extension."""
+    def excel_sheets(self, file_path: str) -> List[str]:
+        """Sheet names of an .xlsx workbook."""
+        return list_sheets(file_path)
+
+    def ingest_excel(self, file_path: str, sheets: Optional[List[str]] = None, header_row: int = 1) -> Optional[str]:
+        """
+        Converts the chosen sheets of an .xlsx workbook to cached Parquet (one process per sheet)
+        and returns its path; pass that path on as the master/reference file.
+        """
+        if self.staging is None:
+            return None
+        return ExcelIngestor(self.staging).ingest(file_path, sheets, header_row)
+
+    def _ensure_extension(self, name: str):
+        """
+        Loads a DuckDB extension the first time it is needed.
+        Order: a local <name>.duckdb_extension file, an already installed copy, then
+        INSTALL from the network (skipped when an extension_dir is configured).
+        """
+        if name in self.loaded_extensions:
+            return
+        local = os.path.join(self.extension_dir, f"{name}.duckdb_extension") if self.extension_dir else None
+        try:
+            if local and os.path.exists(local):
+                self.con.execute(f"LOAD '{local}'")
+            else:
+                self.con.execute(f"LOAD {name}")
+        except Exception as e:
+            if self.extension_dir:
+                raise RuntimeError(f"Extension '{name}' not available offline in {self.extension_dir}: {e}")
+            self.con.execute(f"INSTALL {name}; LOAD {name};")
+        self.loaded_extensions.add(name)
+
+    def _raw_read_func(self, file_path: str, types: Optional[Dict[str, str]] = None) -> str:
+        """
+        Determines the correct DuckDB read function based on file extension.
+        Directories and globs are read as one dataset (Hive partition columns included,
+        files unioned by column name, scanned in parallel); .gz/.zst CSV/TSV is decompressed
+        on the fly. types (column -> DuckDB type) fixes CSV/TSV column types instead of sniffing them.
+        """
         if not file_path:
             return ""
-        ext = os.path.splitext(file_path)[1].lower()
+        if file_path.startswith(MEMORY_PREFIX):
+            return self._memory_view(file_path)
+        ext, suffix = source_format(file_path)
+        source, dataset_opts = file_path, ""
+        if is_dataset(file_path):
+            if os.path.isdir(file_path):
+                source = os.path.join(file_path, "**", f"*{suffix}").replace("\\", "/")
+            dataset_opts = ", union_by_name=true"
+            if any(re.search(r"[\\/][^\\/=]+=[^\\/]*[\\/]", f) for f in dataset_files(file_path)[:100]):
+                dataset_opts += ", hive_partitioning=true"
+        if types:
+            dataset_opts += ", types={" + ", ".join(f"'{c}': '{t}'" for c, t in types.items()) + "}"
         if ext == '.parquet':
-            return f"read_parquet('{file_path}')"
+            return f"read_parquet('{source}'{dataset_opts})"
         elif ext == '.csv':
-            return f"read_csv_auto('{file_path}', ignore_errors=True)"
+            return f"read_csv_auto('{source}', ignore_errors=True{dataset_opts})"
         elif ext in ['.xlsx', '.xls']:
+            self._ensure_extension("spatial")
             return f"spatial.st_read('{file_path}')"
         elif ext in ['.txt', '.tsv']:
-            return f"read_csv_auto('{file_path}', sep='\\t', ignore_errors=True)"
+            return f"read_csv_auto('{source}', sep='\\t', ignore_errors=True{dataset_opts})"
         else:
-            return f"read_csv_auto('{file_path}', ignore_errors=True)"
+            return f"read_csv_auto('{source}', ignore_errors=True{dataset_opts})"
 
     def get_columns(self, file_path: str) -> List[str]:
-        """Scans the header of a file without loading data into memory."""
-        if not file_path or not os.path.exists(file_path):
+        """Returns the column names of a file (staging it on first sight)."""
+        if not self._source_exists(file_path):
             return []
         
         try:
@@ -62,74 +290,824 @@ class LookupEngine:
             print(f"Error scanning columns: {e}")
             return []
 
+    def count_rows(self, file_path: str) -> int:
+        """Row count of a file (answered from Parquet metadata for staged inputs)."""
+        if not self._source_exists(file_path):
+            return 0
+        return int(self.con.execute(f"SELECT COUNT(*) FROM {self._read_func(file_path)}").fetchone()[0])
+
+    def _column_types(self, read_stmt: str) -> Dict[str, str]:
+        """Inferred column types of a read expression or table."""
+        rows = self.con.execute(f"DESCRIBE SELECT * FROM {read_stmt}").fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    def _key_ranges(self, read_a: str, cols: List[str]) -> Dict[str, Tuple[Any, Any, str]]:
+        """(min, max, type) of the given master key columns, computed in a single scan."""
+        types = self._column_types(read_a)
+        cols = [c for c in dict.fromkeys(cols) if c in types]
+        if not cols:
+            return {}
+        aggs = ", ".join(f"MIN(\"{c}\"), MAX(\"{c}\")" for c in cols)
+        row = self.con.execute(f"SELECT {aggs} FROM {read_a}").fetchone()
+        return {c: (row[2 * k], row[2 * k + 1], types[c]) for k, c in enumerate(cols)
+                if row[2 * k] is not None}
+
+    def _key_specs(self, ref: Dict, read_a: str, read_ref: str) -> List[Tuple[List[str], Optional[str]]]:
+        """
+        Per match pair: (declared key_transforms, common cast type or None).
+        Types are only inspected when a pair declares 'cast'.
+        """
+        specs = []
+        types_a: Optional[Dict[str, str]] = None
+        types_r: Optional[Dict[str, str]] = None
+        for (m_col, r_col), names in zip(ref['match_pairs'], transforms_for(ref)):
+            cast_type = None
+            if 'cast' in names:
+                types_a = types_a or self._column_types(read_a)
+                types_r = types_r or self._column_types(read_ref)
+                cast_type = common_type(types_a.get(m_col, 'VARCHAR'), types_r.get(r_col, 'VARCHAR'))
+            specs.append((names, cast_type))
+        return specs
+
+    def _match_conds(self, ref: Dict, specs: List[Tuple[List[str], Optional[str]]],
+                     m_alias: str, r_alias: str) -> str:
+        """Equality conditions between master and registry keys, normalized per _key_specs."""
+        conds = []
+        for (m_col, r_col), (names, cast_type) in zip(ref['match_pairs'], specs):
+            m_expr = key_expr(f"{m_alias}.\"{m_col}\"", names, cast_type)
+            r_expr = key_expr(f"{r_alias}.\"{r_col}\"", names, cast_type)
+            conds.append(f"{m_expr} = {r_expr}")
+        return " AND ".join(conds) or "TRUE"
+
+    def validate_keys(self, file_a: str, ref_files: List[Dict]) -> List[str]:
+        """Warnings for match pairs whose inferred key types cannot be joined as declared."""
+        try:
+            master_types = self._column_types(self._read_func(file_a))
+        except Exception as e:
+            return [f"Master: could not read schema ({e})"]
+        warnings = []
+        for i, ref in enumerate(ref_files):
+            try:
+                ref_types = self._column_types(self._ref_read_func(ref))
+                warnings.extend(key_type_warnings(master_types, ref_types, ref, f"R{i}"))
+                if self._match_type(ref) != 'equal':
+                    t_type = master_types.get(ref['time_col'])
+                    for col in self._temporal_columns(ref):
+                        v_type = ref_types.get(col)
+                        if t_type and v_type and type_family(t_type) != type_family(v_type):
+                            warnings.append(f"R{i}: time column '{ref['time_col']}' ({t_type}) vs '{col}' ({v_type})")
+            except Exception as e:
+                warnings.append(f"R{i}: {e}")
+        return warnings
+
+    def check_intervals(self, ref_files: List[Dict]) -> List[str]:
+        """
+        Warnings for 'interval' references whose validity intervals overlap within a key.
+        Run at preview/compile time only (a windowed sort of the reference); the count is
+        cached per reference fingerprint and columns.
+        """
+        warnings = []
+        for i, ref in enumerate(ref_files):
+            if (ref.get('match_type') or 'equal') != 'interval':
+                continue
+            alias = ref.get('alias', f"R{i}")
+            try:
+                self._match_type(ref)
+                key = (get_file_fingerprint(ref['path']) or ref['path'], tuple(r for _, r in ref['match_pairs']),
+                       ref['valid_from'], ref['valid_to'])
+                if key not in self._interval_overlap_counts:
+                    self._interval_overlap_counts[key] = self._interval_overlaps(ref)
+                overlaps = self._interval_overlap_counts[key]
+            except Exception as e:
+                warnings.append(f"{alias}: {e}")
+                continue
+            if overlaps:
+                warnings.append(f"{alias}: {overlaps:,} validity intervals overlap an earlier one for the same key; "
+                                f"'interval' only considers the latest valid_from and may miss matches")
+        return warnings
+
+    def _interval_overlaps(self, ref: Dict) -> int:
+        """Reference rows whose interval starts before an earlier interval of the same key ends."""
+        keys = ", ".join(f"\"{r_col}\"" for _, r_col in ref['match_pairs']) or "NULL"
+        vf, vt = f"\"{ref['valid_from']}\"", f"\"{ref['valid_to']}\""
+        window = f"PARTITION BY {keys} ORDER BY {vf} ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING"
+        return int(self.con.execute(
+            f"SELECT COUNT(*) FROM (SELECT {vf} AS vf, MAX({vt}) OVER w AS prev_end, "
+            f"COUNT(*) FILTER (WHERE {vt} IS NULL) OVER w AS prev_open "
+            f"FROM {self._ref_read_func(ref)} WINDOW w AS ({window})) "
+            f"WHERE prev_open > 0 OR prev_end > vf"
+        ).fetchone()[0])
+
     def _generate_multi_join_query(self, 
                                   file_a: str, 
-                                  ref_files: List[Dict]) -> str:
+                                  ref_files: List[Dict],
+                                  master_source: Optional[str] = None,
+                                  ref_sources: Optional[List[str]] = None,
+                                  master_cols: Optional[List[str]] = None,
+                                  prefilter_keys: bool = True,
+                                  match_flags: bool = False,
+                                  prune_ranges: bool = True) -> str:
         """
         Generates a SQL query for a chain of LEFT JOINs.
-        ref_files structure: [{'path': str, 'match_pairs': List[Tuple], 'pull_cols': List[str]}]
+        ref_files structure: [{'path': str, 'match_pairs': List[Tuple], 'pull_cols': List[str],
+                               'key_transforms': Optional[List] (one per pair, see keys.py)}]
+        master_source / ref_sources optionally replace the file scans (e.g. with sampled temp tables).
+        master_cols limits the carried master columns (None keeps A.*).
+        Each reference is scanned as a projected subquery over its keys and pull columns,
+        pre-filtered to keys present in the master when prefilter_keys is set and the master
+        is small next to the reference (see _prefilter_wanted); references anchored on the same
+        master keys share one materialized set of distinct master keys.
+        Normalized keys are computed once per side in these projections.
+        match_flags adds a __R{i}__matched indicator column per reference (see matchstats.py).
+        prune_ranges bounds untransformed reference keys to the master's min/max, which DuckDB
+        pushes into the scan to skip Parquet row groups (and Hive partitions) outside the range.
         """
-        read_a = self._read_func(file_a)
-        
-        # Start building the SELECT and FROM clauses
-        select_parts = ["A.*"]
-        from_clause = f"{read_a} AS A"
+        read_a = master_source or self._read_func(file_a)
+        ranges: Dict[str, Tuple[Any, Any, str]] = {}
+        if prune_ranges and not ref_sources:
+            plain = [m_col for ref in ref_files for (m_col, _), names in zip(ref['match_pairs'], transforms_for(ref))
+                     if not names]
+            try:
+                ranges = self._key_ranges(read_a, plain)
+            except Exception as e:
+                print(f"Key range warning: {e}")
         
+        master_keys = []  # normalized master key columns: (name, expr)
+        key_sets: Dict[Tuple[str, ...], str] = {}  # master key expressions -> CTE of their distinct values
+        master_rows: List[Optional[int]] = []
+        ref_parts = []
         for i, ref in enumerate(ref_files):
-            alias = f"R{i}"
-            read_ref = self._read_func(ref['path'])
-            
-            # Add columns to pull
-            for col in ref['pull_cols']:
-                # Alias to avoid collisions: R0_email, R1_phone etc
-                select_parts.append(f"{alias}.\"{col}\" AS \"{alias}_{col}\"") # type: ignore
+            alias = ref.get('alias', f"R{i}")
+            read_ref = ref_sources[i] if ref_sources else self._ref_read_func(ref)
             
-            # Build JOIN condition
+            needed = []
+            key_names = []  # key column names as projected by the reference scan
             join_conds = []
-            for pair in ref['match_pairs']:
-                join_conds.append(f"A.\"{pair[0]}\" = {alias}.\"{pair[1]}\"") # type: ignore
+            semi_conds = []  # (master key expression, reference key expression)
+            range_conds = []
+            ref_types = self._column_types(read_ref) if ranges else {}
+            for j, ((m_col, r_col), (names, cast_type)) in enumerate(
+                    zip(ref['match_pairs'], self._key_specs(ref, read_a, read_ref))):
+                if names:
+                    m_name, r_name = f"__{alias}_k{j}", f"__k{j}"
+                    r_expr = key_expr(f"S.\"{r_col}\"", names, cast_type)
+                    master_keys.append((m_name, key_expr(f"\"{m_col}\"", names, cast_type)))
+                    needed.append(f"{r_expr} AS \"{r_name}\"")
+                    key_names.append(r_name)
+                    join_conds.append(f"A.\"{m_name}\" = {alias}.\"{r_name}\"") # type: ignore
+                    semi_conds.append((key_expr(f"\"{m_col}\"", names, cast_type), r_expr))
+                else:
+                    needed.append(f"S.\"{r_col}\"")
+                    key_names.append(r_col)
+                    join_conds.append(f"A.\"{m_col}\" = {alias}.\"{r_col}\"") # type: ignore
+                    semi_conds.append((f"\"{m_col}\"", f"S.\"{r_col}\""))
+                    if m_col in ranges and r_col in ref_types:
+                        low, high, m_type = ranges[m_col]
+                        if type_family(m_type) == type_family(ref_types[r_col]) != "other":
+                            range_conds.append(f"S.\"{r_col}\" BETWEEN {_literal(low, m_type)} AND {_literal(high, m_type)}")
+            
+            # Project only the registry keys and pulled columns
+            needed.extend(f"S.\"{c}\"" for c in ref['pull_cols'])
+            if ref.get('match_policy') == 'latest':
+                needed.append(f"S.\"{ref['order_by']}\"")
+            temporal = self._match_type(ref) != 'equal'
+            valid_sql = None
+            if temporal:
+                # Sort-based ASOF merge on valid_from; 'interval' then checks valid_to per row
+                needed.extend(f"S.\"{c}\"" for c in self._temporal_columns(ref))
+                join_conds.append(f"A.\"{ref['time_col']}\" >= {alias}.\"{ref['valid_from']}\"")
+                if ref.get('match_type') == 'interval':
+                    valid_sql = (f"({alias}.\"{ref['valid_to']}\" IS NULL OR "
+                                 f"A.\"{ref['time_col']}\" < {alias}.\"{ref['valid_to']}\")")
+            ref_scan = f"SELECT {', '.join(dict.fromkeys(needed))} FROM {read_ref} AS S"
+            filters = list(range_conds)
+            if prefilter_keys and semi_conds and self._prefilter_wanted(read_a, ref, master_rows):
+                # Semi-join against the master's distinct anchor keys drops rows that can never match
+                # (an explicit SEMI JOIN: EXISTS combined with the range filters plans as a slow mark join)
+                m_exprs = tuple(m for m, _ in semi_conds)
+                if m_exprs not in key_sets:
+                    key_sets[m_exprs] = f"__mkeys_{len(key_sets)}"
+                conds = " AND ".join(f"M.k{j} = {r}" for j, (_, r) in enumerate(semi_conds))
+                ref_scan += f" SEMI JOIN {key_sets[m_exprs]} AS M ON {conds}"
+            if filters:
+                ref_scan += f" WHERE {' AND '.join(filters)}"
+            ref_scan = self._apply_match_policy(ref, ref_scan, key_names)
+            if match_flags:
+                ref_scan = f"SELECT *, TRUE AS \"{MATCH_FLAG}\" FROM ({ref_scan})"
             
             join_clause = " AND ".join(join_conds)
-            from_clause += f" LEFT JOIN {read_ref} AS {alias} ON {join_clause}" # type: ignore
+            join_kind = "ASOF LEFT JOIN" if temporal else "LEFT JOIN"
+            ref_parts.append((alias, ref, f" {join_kind} ({ref_scan}) AS {alias} ON {join_clause}", valid_sql))
+
+        # Start building the SELECT and FROM clauses
+        key_sql = [f"{expr} AS \"{name}\"" for name, expr in master_keys]
+        if master_cols:
+            carried = list(dict.fromkeys(list(master_cols) + self._anchor_columns(ref_files)))
+            carried_sql = ", ".join([f"\"{c}\"" for c in carried] + key_sql)
+            select_parts = [f"A.\"{c}\"" for c in master_cols]
+            from_clause = f"(SELECT {carried_sql} FROM {read_a}) AS A"
+        elif master_keys:
+            key_names = ", ".join(f"\"{name}\"" for name, _ in master_keys)
+            select_parts = [f"A.* EXCLUDE ({key_names})"]
+            from_clause = f"(SELECT *, {', '.join(key_sql)} FROM {read_a}) AS A"
+        else:
+            select_parts = ["A.*"]
+            from_clause = f"{read_a} AS A"
+        
+        pulled = []
+        for alias, ref, join_sql, valid_sql in ref_parts:
+            # Add columns to pull (planned builds may serve several original references)
+            for out_alias, col in ref.get('outputs') or [(alias, c) for c in ref['pull_cols']]:
+                # Alias to avoid collisions: R0_email, R1_phone etc
+                value = f"{alias}.\"{col}\""
+                if valid_sql:
+                    value = f"CASE WHEN {valid_sql} THEN {value} END"
+                pulled.append((int(out_alias[1:]), len(pulled), f"{value} AS \"{out_alias}_{col}\""))
+            if ref.get('match_policy') == 'count':
+                for out_alias in ref.get('sources') or [alias]:
+                    pulled.append((int(out_alias[1:]), len(pulled),
+                                   f"COALESCE({alias}.\"__match_count\", 0) AS \"{out_alias}_match_count\""))
+            from_clause += join_sql # type: ignore
+        # Keep output columns in original reference order whatever the join order
+        select_parts.extend(sql for _, _, sql in sorted(pulled))
+        if match_flags:
+            for alias, ref, _, valid_sql in ref_parts:
+                flag = f"{alias}.\"{MATCH_FLAG}\""
+                if valid_sql:
+                    flag = f"CASE WHEN {valid_sql} THEN {flag} END"
+                for out_alias in ref.get('sources') or [alias]:
+                    select_parts.append(f"{flag} AS \"{flag_column(out_alias)}\"")
             
         query = f"SELECT {', '.join(select_parts)} FROM {from_clause}" # type: ignore
+        if key_sets:
+            # Each distinct master key set is computed once, however many references use it
+            ctes = [f"{name} AS MATERIALIZED (SELECT DISTINCT "
+                    f"{', '.join(f'{expr} AS k{j}' for j, expr in enumerate(exprs))} FROM {read_a})"
+                    for exprs, name in key_sets.items()]
+            query = f"WITH {', '.join(ctes)} {query}"
         return query
 
+    def _prefilter_wanted(self, read_a: str, ref: Dict, master_rows: List[Optional[int]]) -> bool:
+        """
+        Whether semi-joining a reference to the master's keys can pay for the extra master scan:
+        only when the master source actually joined (read_a: the file, a bucket or an incremental
+        slice; its row count bounds its distinct keys) has at most PREFILTER_MAX_RATIO times the
+        reference's rows. master_rows memoizes the master count across the references of one
+        query. Counts come from Parquet metadata for staged inputs.
+        """
+        try:
+            if not master_rows:
+                master_rows.append(int(self.con.execute(f"SELECT COUNT(*) FROM {read_a}").fetchone()[0]))
+            ref_rows = (ref.get('stats') or {}).get('rows')
+            if ref_rows is None:
+                ref_rows = int(self.con.execute(f"SELECT COUNT(*) FROM {self._ref_read_func(ref)}").fetchone()[0])
+        except Exception:
+            return True
+        return master_rows[0] <= PREFILTER_MAX_RATIO * ref_rows
+
+    @staticmethod
+    def _match_type(ref: Dict) -> str:
+        """Validates ref['match_type'] and its columns; returns the type."""
+        match_type = ref.get('match_type') or 'equal'
+        if match_type not in MATCH_TYPES:
+            raise ValueError(f"Unknown match type '{match_type}' (expected one of {', '.join(MATCH_TYPES)})")
+        if match_type != 'equal':
+            required = ['time_col', 'valid_from'] + (['valid_to'] if match_type == 'interval' else [])
+            missing = [name for name in required if not ref.get(name)]
+            if missing:
+                raise ValueError(f"match_type '{match_type}' requires {', '.join(missing)}")
+            if (ref.get('match_policy') or 'all') != 'all':
+                raise ValueError(f"match_policy does not apply to '{match_type}' references (they match at most one row)")
+        return match_type
+
+    @staticmethod
+    def _temporal_columns(ref: Dict) -> List[str]:
+        """Registry validity columns an asof/interval reference needs."""
+        if (ref.get('match_type') or 'equal') == 'equal':
+            return []
+        return [ref['valid_from']] + ([ref['valid_to']] if ref.get('match_type') == 'interval' else [])
+
+    def _ref_columns(self, ref: Dict) -> List[str]:
+        """Raw registry columns a reference scan needs: keys, pulled, order_by and validity columns."""
+        cols = [p[1] for p in ref['match_pairs']] + list(ref['pull_cols'])
+        if ref.get('order_by'):
+            cols.append(ref['order_by'])
+        return list(dict.fromkeys(cols + self._temporal_columns(ref)))
+
+    @staticmethod
+    def _anchor_columns(ref_files: List[Dict]) -> List[str]:
+        """Master columns the joins read: anchor keys and asof/interval time columns."""
+        cols = [pair[0] for ref in ref_files for pair in ref['match_pairs']]
+        cols += [ref['time_col'] for ref in ref_files if (ref.get('match_type') or 'equal') != 'equal']
+        return list(dict.fromkeys(cols))
+
+    def _temporal_conds(self, ref: Dict, m_alias: str, r_alias: str) -> List[str]:
+        """Row-level validity of a registry row for a master row (used outside the ASOF join)."""
+        if self._match_type(ref) == 'equal':
+            return []
+        t = f"{m_alias}.\"{ref['time_col']}\""
+        conds = [f"{r_alias}.\"{ref['valid_from']}\" <= {t}"]
+        if ref.get('match_type') == 'interval':
+            conds.append(f"({r_alias}.\"{ref['valid_to']}\" IS NULL OR {t} < {r_alias}.\"{ref['valid_to']}\")")
+        return conds
+
+    def _apply_match_policy(self, ref: Dict, ref_scan: str, key_names: List[str]) -> str:
+        """
+        Deduplicates a reference scan once, per ref['match_policy'] (see MATCH_POLICIES):
+        'all' keeps every match, 'first' keeps any one row per key, 'latest' keeps the row
+        with the highest ref['order_by'], 'list' aggregates pulled values into lists and
+        'count' adds __match_count (pulled values are taken from any one match).
+        """
+        policy = ref.get('match_policy') or 'all'
+        if policy not in MATCH_POLICIES:
+            raise ValueError(f"Unknown match policy '{policy}' (expected one of {', '.join(MATCH_POLICIES)})")
+        if policy == 'all':
+            return ref_scan
+        keys = ", ".join(f"\"{k}\"" for k in key_names)
+        pulls = [c for c in ref['pull_cols'] if c not in key_names]
+        if policy == 'first':
+            return f"SELECT DISTINCT ON ({keys}) * FROM ({ref_scan})"
+        if policy == 'latest':
+            if not ref.get('order_by'):
+                raise ValueError("match_policy 'latest' requires an 'order_by' column")
+            return (f"SELECT DISTINCT ON ({keys}) * FROM ({ref_scan}) "
+                    f"ORDER BY {keys}, \"{ref['order_by']}\" DESC NULLS LAST")
+        if policy == 'list':
+            aggs = "".join(f", list(\"{c}\") AS \"{c}\"" for c in pulls)
+            return f"SELECT {keys}{aggs} FROM ({ref_scan}) GROUP BY ALL"
+        aggs = "".join(f", any_value(\"{c}\") AS \"{c}\"" for c in pulls)
+        return f"SELECT {keys}, COUNT(*) AS \"__match_count\"{aggs} FROM ({ref_scan}) GROUP BY ALL"
+
+    def check_fanout(self, ref_files: List[Dict]) -> Tuple[Dict[str, float], List[str]]:
+        """
+        Estimates each reference's key duplication factor from a key sample before a run.
+        Returns ({alias: factor}, warnings for 'all'-policy references that would multiply rows).
+        """
+        planner = JoinPlanner(self)
+        factors = {}
+        warnings = []
+        growth = 1.0
+        for i, ref in enumerate(ref_files):
+            alias = ref.get('alias', f"R{i}")
+            stats = ref.get('stats') or planner.reference_stats(ref)
+            factors[alias] = float(stats.get('duplication', 1.0))
+            # approx_count_distinct is within a few percent, so ignore tiny factors
+            # asof/interval references match at most one row per master row
+            if (ref.get('match_policy') or 'all') == 'all' and factors[alias] > 1.05 and \
+                    (ref.get('match_type') or 'equal') == 'equal':
+                growth *= factors[alias]
+                warnings.append(f"{alias}: registry keys repeat x{factors[alias]:.2f} on average; "
+                                f"each match multiplies master rows (consider 'first', 'latest', 'list' or 'count')")
+        if growth > 1.05:
+            warnings.append(f"Estimated output growth across the chain: x{growth:.2f} of matched master rows")
+        return factors, warnings
+
+    def plan_joins(self, ref_files: List[Dict]) -> List[Dict]:
+        """Reorders and merges the reference chain by estimated build size and prints the plan."""
+        try:
+            planned, description = JoinPlanner(self).plan(ref_files)
+        except Exception as e:
+            print(f"Planner warning: {e}")
+            return ref_files
+        print(description)
+        self.last_plan = description
+        return planned
+
+    def _copy_options(self, output_format: str, write_options: Optional[Dict] = None) -> str:
+        """
+        Builds the COPY option list.
+        write_options: partition_by (List[str]), per_thread_output (bool), file_size_bytes (str/int),
+        rows_per_file (int, Parquet only), compression (codec), row_group_size (int, Parquet only).
+        Partitioned, per-thread and split outputs write a directory of files at output_path.
+        """
+        opts = write_options or {}
+        is_parquet = output_format.lower() == 'parquet'
+        parts = ["FORMAT PARQUET"] if is_parquet else ["FORMAT CSV", "HEADER"]
+
+        if opts.get('compression'):
+            parts.append(f"COMPRESSION '{opts['compression']}'")
+        if opts.get('rows_per_file'):
+            if not is_parquet:
+                raise ValueError("rows_per_file requires parquet output; use file_size_bytes for CSV")
+            rows = int(opts['rows_per_file'])
+            group = int(opts.get('row_group_size') or min(rows, 122880))
+            parts.append(f"ROW_GROUP_SIZE {group}")
+            parts.append(f"ROW_GROUPS_PER_FILE {max(1, rows // group)}")
+        elif opts.get('row_group_size') and is_parquet:
+            parts.append(f"ROW_GROUP_SIZE {int(opts['row_group_size'])}")
+        if opts.get('file_size_bytes'):
+            size = opts['file_size_bytes']
+            parts.append(f"FILE_SIZE_BYTES '{size}'" if isinstance(size, str) else f"FILE_SIZE_BYTES {int(size)}")
+        if opts.get('partition_by'):
+            cols = ", ".join(f"\"{c}\"" for c in opts['partition_by'])
+            parts.append(f"PARTITION_BY ({cols})")
+        if opts.get('per_thread_output'):
+            parts.append("PER_THREAD_OUTPUT true")
+        return ", ".join(parts)
+
+    def _prepare_join(self, file_a: str, ref_files: List[Dict], master_cols: Optional[List[str]],
+                      prefilter_keys: bool, optimize_plan: bool, match_flags: bool = False,
+                      generate: bool = True) -> Tuple[str, List[Dict], Dict[str, float]]:
+        """
+        Stages inputs, checks keys, plans the chain and returns (query, planned refs, stage timings).
+        With generate unset the query is left empty (the caller builds its own).
+        """
+        stages: Dict[str, float] = {}
+        start = time.time()
+        # Resolve (and stage) every input up front so parsing time is reported separately
+        self._read_func(file_a)
+        for ref in ref_files:
+            self._ref_read_func(ref)
+        stages['staging'] = time.time() - start
+
+        start = time.time()
+        for warning in self.validate_keys(file_a, ref_files) + self.check_intervals(ref_files):
+            print(f"Key warning: {warning}")
+        if optimize_plan and ref_files:
+            ref_files = self.plan_joins(ref_files)
+        try:
+            for warning in self.check_fanout(ref_files)[1]:
+                print(f"Fan-out warning: {warning}")
+        except Exception as e:
+            print(f"Fan-out check warning: {e}")
+        query = ""
+        if generate:
+            query = self._generate_multi_join_query(file_a, ref_files, master_cols=master_cols,
+                                                    prefilter_keys=prefilter_keys, match_flags=match_flags)
+        stages['planning'] = time.time() - start
+        return query, ref_files, stages
+
     def execute_multi_join(self, 
                            file_a: str, 
                            ref_files: List[Dict], 
                            output_path: str,
-                           output_format: str = 'csv'):
-        """Performs disk-to-disk multi-file join."""
-        query = self._generate_multi_join_query(file_a, ref_files)
+                           output_format: str = 'csv',
+                           master_cols: Optional[List[str]] = None,
+                           prefilter_keys: bool = True,
+                           write_options: Optional[Dict] = None,
+                           optimize_plan: bool = True,
+                           profile: bool = False,
+                           collect_stats: bool = True,
+                           partitions: int = 0,
+                           partition_workers: int = 1,
+                           use_cache: bool = True):
+        """
+        Performs disk-to-disk multi-file join.
+        With profile set, DuckDB's JSON profile is captured and a run report
+        (stage timings, per-operator time, join rows, peak memory, spill) is saved
+        next to the output and kept in self.last_report.
+        With collect_stats set (the default), per-reference match counts and pulled-column null
+        rates are counted while the result streams to disk, saved as <output>.stats.json and
+        kept in self.last_match_stats (single-file outputs only). The result then passes through
+        Arrow batches on one writer stream, which costs roughly 10-25% of join time over a plain
+        COPY; pass collect_stats=False when the statistics are not needed.
+        With partitions > 1 the join runs out of core through PartitionedJoin (see partitioned.py):
+        inputs are hash-partitioned on disk and joined bucket by bucket, partition_workers at a
+        time; progress per bucket is exposed via self.partitioned.progress. Single-file only.
+        With use_cache set, an identical request (same spec, unchanged inputs, same output,
+        stats, profile and partition options) returns the existing output from the result cache instead of re-running.
+        """
+        if is_multi_file_output(write_options) and os.path.isdir(output_path) and os.listdir(output_path):
+            # COPY would have to overwrite the directory, deleting every file already in it
+            return False, f"Output directory '{output_path}' is not empty; choose an empty or new directory."
+        cache_key = None
+        if use_cache and self.results is not None:
+            cache_key = self.results.key("output", file_a, ref_files, output_format=output_format.lower(),
+                                         master_cols=master_cols, write_options=write_options,
+                                         prefilter_keys=prefilter_keys, optimize_plan=optimize_plan,
+                                         # Stats/report sidecars and partitioned row order differ too
+                                         collect_stats=collect_stats, profile=profile,
+                                         partitions=partitions if partitions and partitions > 1 else 0)
+            cached = self.results.get_output(cache_key, output_path)
+            if cached:
+                self.last_match_stats = cached["match_stats"]
+                return True, f"{cached['message']} (cached)"
+        inputs = [file_a] + [ref['path'] for ref in ref_files]
+        partitioned = partitions and partitions > 1
+        if partitioned and is_multi_file_output(write_options):
+            return False, "Partitioned mode writes a single output file; drop partition/split write options."
+        collect_stats = collect_stats and not is_multi_file_output(write_options)
+        query, ref_files, stages = self._prepare_join(file_a, ref_files, master_cols, prefilter_keys,
+                                                      optimize_plan, match_flags=collect_stats,
+                                                      generate=not partitioned)
         
+        profile_path = os.path.join(self.temp_dir, f"profile_{uuid.uuid4().hex[:8]}.json")
         try:
-            if output_format.lower() == 'parquet':
-                self.con.execute(f"COPY ({query}) TO '{output_path}' (FORMAT PARQUET)")
-            else:
-                self.con.execute(f"COPY ({query}) TO '{output_path}' (FORMAT CSV, HEADER)")
-            return True, f"Success! Chain join completed."
+            options = self._copy_options(output_format, write_options)
+            # Partitioned runs profile each bucket join instead of the whole pipeline
+            if profile and not partitioned:
+                enable_profiling(self.con, profile_path)
+            start = time.time()
+            try:
+                if partitioned:
+                    self.partitioned = PartitionedJoin(self, partitions, partition_workers, profile=profile)
+                    stats, bucket_stages = self.partitioned.run(file_a, ref_files, output_path, output_format,
+                                                                master_cols, collect_stats, write_options)
+                    stages.update(bucket_stages)
+                elif collect_stats:
+                    stats = self._write_with_stats(query, ref_files, output_path, output_format, write_options)
+                else:
+                    self.con.execute(f"COPY ({query}) TO '{output_path}' ({options})")
+            finally:
+                if profile and not partitioned:
+                    self.con.execute("PRAGMA disable_profiling")
+            stages['join_and_write'] = time.time() - start
         except Exception as e:
             return False, f"SQL Error: {str(e)}"
 
+        if profile:
+            extra = {"plan": self.last_plan if optimize_plan else "", "output_path": output_path}
+            if partitioned:
+                self.last_report = build_partitioned_report(self.partitioned.bucket_profiles, stages, extra)
+            else:
+                self.last_report = build_run_report(load_profile(profile_path), stages, extra)
+            # Measured on disk: stats and partitioned writes bypass DuckDB's COPY byte counter
+            self.last_report["totals"]["bytes_written"] = get_path_size(output_path)
+            try:
+                save_run_report(self.last_report, output_path)
+            except Exception as e:
+                print(f"Run report warning: {e}")
+        if collect_stats:
+            self.last_match_stats = stats.summary()
+            try:
+                stats.save(output_path)
+            except Exception as e:
+                print(f"Match stats warning: {e}")
+        message = "Success! Chain join completed."
+        if collect_stats and stats.pulled:
+            message = f"Success! Chain join completed. {stats.describe()}"
+        if cache_key:
+            self.results.put_output(cache_key, output_path, message, inputs,
+                                    self.last_match_stats if collect_stats else None)
+        return True, message
+
+    @staticmethod
+    def _pulled_columns(ref_files: List[Dict]) -> Dict[str, List[str]]:
+        """Output alias -> pulled output column names (planned builds may serve several aliases)."""
+        pulled: Dict[str, List[str]] = {}
+        for i, ref in enumerate(ref_files):
+            alias = ref.get('alias', f"R{i}")
+            for out_alias in ref.get('sources') or [alias]:
+                pulled.setdefault(out_alias, [])
+            for out_alias, col in ref.get('outputs') or [(alias, c) for c in ref['pull_cols']]:
+                pulled[out_alias].append(f"{out_alias}_{col}")
+        # Report in reference order (R0, R1, ...), not in planned build order
+        order = lambda alias: (0, int(alias[1:])) if alias[1:].isdigit() else (1, 0)
+        return dict(sorted(pulled.items(), key=lambda item: order(item[0])))
+
+    def _write_with_stats(self, query: str, ref_files: List[Dict], output_path: str,
+                          output_format: str, write_options: Optional[Dict] = None,
+                          batch_rows: int = 1_000_000, header: bool = True) -> MatchStats:
+        """
+        Streams the enriched result as Arrow batches into a single CSV/Parquet file,
+        counting matches and nulls per batch so no second scan of the output is needed.
+        CSV is written by one COPY that reads the counted batch stream, so the file is formatted
+        exactly like every COPY-written output; header=False omits the CSV header row.
+        """
+        import pyarrow as pa # type: ignore
+        import pyarrow.parquet as pq # type: ignore
+
+        opts = write_options or {}
+        is_parquet = output_format.lower() == 'parquet'
+        pulled = self._pulled_columns(ref_files)
+
+        stats = MatchStats(pulled)
+        reader = self.con.execute(query).fetch_record_batch(batch_rows)
+        flags = {flag_column(alias) for alias in pulled}
+        keep = [i for i, name in enumerate(reader.schema.names) if name not in flags]
+        out_schema = pa.schema([reader.schema.field(i) for i in keep])
+
+        if is_parquet:
+            codec = str(opts.get('compression') or 'snappy').lower()
+            writer = pq.ParquetWriter(output_path, out_schema, compression=PARQUET_CODECS.get(codec, codec))
+            try:
+                for batch in reader:
+                    stats.update(batch)
+                    out = pa.RecordBatch.from_arrays([batch.column(i) for i in keep], schema=out_schema)
+                    if opts.get('row_group_size'):
+                        writer.write_batch(out, row_group_size=int(opts['row_group_size']))
+                    else:
+                        writer.write_batch(out)
+            finally:
+                writer.close()
+            return stats
+
+        # One DuckDB CSV writer over the counted batch stream: formatted exactly like every
+        # COPY-written output, with no intermediate part files
+        def counted():
+            for batch in reader:
+                stats.update(batch)
+                yield pa.RecordBatch.from_arrays([batch.column(i) for i in keep], schema=out_schema)
+
+        options = self._copy_options(output_format, opts)
+        if not header:
+            options = options.replace("HEADER", "HEADER false", 1)
+        writer_con = self.con.cursor()
+        try:
+            writer_con.register("__stats_batches", pa.RecordBatchReader.from_batches(out_schema, counted()))
+            writer_con.execute(f"COPY (SELECT * FROM __stats_batches) TO '{output_path}' ({options})")
+        finally:
+            writer_con.close()
+        return stats
+
+    def execute_to_reader(self,
+                          file_a: str,
+                          ref_files: List[Dict],
+                          batch_rows: int = 100_000,
+                          master_cols: Optional[List[str]] = None,
+                          prefilter_keys: bool = True,
+                          optimize_plan: bool = True):
+        """
+        Runs the chain join and returns a pyarrow RecordBatchReader over the enriched result,
+        yielding batches of up to batch_rows rows as DuckDB produces them (bounded memory).
+        The reader holds this engine's connection: drain or close it before the next query.
+        """
+        query, _, _ = self._prepare_join(file_a, ref_files, master_cols, prefilter_keys, optimize_plan)
+        return self.con.execute(query).fetch_record_batch(batch_rows)
+
     def get_multi_preview(self, 
                           file_a: str, 
                           ref_files: List[Dict], 
-                          limit: int = 10):
-        """Generates a preview for the chain join."""
-        query = self._generate_multi_join_query(file_a, ref_files)
-        query += f" LIMIT {limit}"
+                          limit: int = 10,
+                          master_cols: Optional[List[str]] = None,
+                          as_arrow: bool = False):
+        """Generates a preview for the chain join (a pyarrow Table with as_arrow)."""
+        preview, _ = self.get_sampled_preview(file_a, ref_files, limit, master_cols=master_cols, as_arrow=as_arrow)
+        return preview
+
+    def get_sampled_preview(self,
+                            file_a: str,
+                            ref_files: List[Dict],
+                            limit: int = 10,
+                            sample_size: int = 1000,
+                            master_cols: Optional[List[str]] = None,
+                            as_arrow: bool = False,
+                            use_cache: bool = True):
+        """
+        Fast preview: takes the first sample_size master rows, semi-joins each
+        reference to those keys and joins only the surviving rows.
+        Returns (preview DataFrame, or pyarrow Table with as_arrow, or None, {'R0': match_rate, ...}).
+        Identical requests over unchanged inputs are served from the result cache.
+        """
+        cache_key = None
+        if use_cache and self.results is not None:
+            cache_key = self.results.key("preview", file_a, ref_files, limit=limit, sample_size=sample_size,
+                                         master_cols=master_cols, as_arrow=as_arrow)
+            cached = self.results.get_preview(cache_key)
+            if cached:
+                return cached
+        tables = ["__preview_master"]
         try:
-            return self.con.execute(query).df()
+            self.con.execute(
+                f"CREATE OR REPLACE TEMP TABLE __preview_master AS "
+                f"SELECT * FROM {self._read_func(file_a)} LIMIT {int(sample_size)}"
+            )
+            ref_sources = []
+            match_rates = {}
+            for i, ref in enumerate(ref_files):
+                table = f"__preview_r{i}"
+                tables.append(table)
+                read_ref = self._ref_read_func(ref)
+                specs = self._key_specs(ref, "__preview_master", read_ref)
+                cols = ", ".join(f"S.\"{c}\"" for c in self._ref_columns(ref))
+                semi_conds = self._match_conds(ref, specs, "P", "S")
+                self.con.execute(
+                    f"CREATE OR REPLACE TEMP TABLE {table} AS "
+                    f"SELECT {cols} FROM {read_ref} AS S "
+                    f"WHERE EXISTS (SELECT 1 FROM __preview_master AS P WHERE {semi_conds})"
+                )
+                ref_sources.append(table)
+
+                match_conds = " AND ".join([self._match_conds(ref, specs, "A", "R")] +
+                                           self._temporal_conds(ref, "A", "R"))
+                rate = self.con.execute(
+                    f"SELECT AVG(CASE WHEN EXISTS (SELECT 1 FROM {table} AS R WHERE {match_conds}) "
+                    f"THEN 1.0 ELSE 0.0 END) FROM __preview_master AS A"
+                ).fetchone()[0]
+                match_rates[f"R{i}"] = float(rate or 0.0)
+
+            # References are already reduced to the sample's keys, so skip the pre-filter
+            query = self._generate_multi_join_query(file_a, ref_files, "__preview_master", ref_sources,
+                                                    master_cols=master_cols, prefilter_keys=False)
+            query += f" LIMIT {limit}"
+            result = self.con.execute(query)
+            preview = result.fetch_arrow_table() if as_arrow else result.df()
+            if cache_key:
+                self.results.put_preview(cache_key, preview, match_rates, [file_a] + [r['path'] for r in ref_files])
+            return preview, match_rates
         except Exception as e:
             print(f"Preview error: {e}")
-            return None
+            return None, {}
+        finally:
+            for table in tables:
+                try:
+                    self.con.execute(f"DROP TABLE IF EXISTS {table}")
+                except Exception:
+                    pass
+
+    def load_reference(self, path: str, key_cols: List[str], pull_cols: List[str]) -> Dict:
+        """
+        Makes a reference resident for lookups: a temp table holding one row per key
+        (first match) over key_cols + pull_cols, with a unique ART index on the keys.
+        Reloads when the source changes or new pull columns are requested.
+        """
+        spec_key = (os.path.abspath(path), tuple(key_cols))
+        fingerprint = get_file_fingerprint(path)
+        entry = self._lookup_tables.get(spec_key)
+        if entry and entry['fingerprint'] == fingerprint and set(pull_cols) <= set(entry['cols']):
+            return entry
+
+        cols = list(dict.fromkeys((entry['cols'] if entry else []) + list(pull_cols)))
+        cols = [c for c in cols if c not in key_cols]
+        table = entry['table'] if entry else f"__lookup_{len(self._lookup_tables)}"
+        source = self._ref_read_func({'path': path, 'match_pairs': [(k, k) for k in key_cols], 'pull_cols': cols})
+        keys_sql = ", ".join(f"\"{c}\"" for c in key_cols)
+        cols_sql = ", ".join(f"\"{c}\"" for c in list(key_cols) + cols)
+        not_null = " AND ".join(f"\"{c}\" IS NOT NULL" for c in key_cols)
+        self.con.execute(
+            f"CREATE OR REPLACE TEMP TABLE {table} AS "
+            f"SELECT DISTINCT ON ({keys_sql}) {cols_sql} FROM {source} WHERE {not_null}"
+        )
+        self.con.execute(f"CREATE UNIQUE INDEX {table}_keys ON {table} ({keys_sql})")
+        types = dict(self.con.execute(
+            f"SELECT column_name, data_type FROM duckdb_columns() WHERE table_name = '{table}'"
+        ).fetchall())
+
+        entry = {'table': table, 'fingerprint': fingerprint, 'cols': cols,
+                 'key_types': [types[c] for c in key_cols]}
+        self._lookup_tables[spec_key] = entry
+        # Cached results may be stale (or lack the new columns) after a reload
+        for cache_key in [k for k in self._lookup_cache if k[0] == spec_key]:
+            del self._lookup_cache[cache_key]
+        return entry
+
+    def lookup(self,
+               ref: Union[str, Dict],
+               keys: List[Any],
+               pull_cols: List[str],
+               key_cols: Optional[List[str]] = None) -> List[Optional[Dict]]:
+        """
+        Looks up a batch of keys in a reference with one vectorized query.
+        ref is a path or a ref_files entry (its registry keys are used); keys are scalars,
+        or tuples for composite keys. Returns one {col: value} dict per key, None on a miss.
+        """
+        if isinstance(ref, dict):
+            path = ref['path']
+            key_cols = key_cols or [pair[1] for pair in ref['match_pairs']]
+        else:
+            path = ref
+        if not key_cols:
+            raise ValueError("lookup requires key_cols when ref is a path")
+        spec_key = (os.path.abspath(path), tuple(key_cols))
+        pulls = tuple(pull_cols)
+        norm_keys = [k if isinstance(k, tuple) else (k,) for k in keys]
+
+        results: Dict[Tuple, Optional[Dict]] = {}
+        missing = []
+        for k in dict.fromkeys(norm_keys):
+            cache_key = (spec_key, pulls, k)
+            if cache_key in self._lookup_cache:
+                self._lookup_cache.move_to_end(cache_key)
+                results[k] = self._lookup_cache[cache_key]
+                self.lookup_hits += 1
+            else:
+                missing.append(k)
+                self.lookup_misses += 1
+
+        if missing:
+            entry = self.load_reference(path, key_cols, list(pull_cols))
+            # Positions travel with the keys so results map back regardless of type coercion
+            key_lists = [list(range(len(missing)))] + [[k[i] for k in missing] for i in range(len(key_cols))]
+            unnest_sql = ", ".join(["unnest(?::BIGINT[]) AS pos"] +
+                                   [f"unnest(?::{t}[]) AS k{i}" for i, t in enumerate(entry['key_types'])])
+            on_sql = " AND ".join(f"K.k{i} = T.\"{c}\"" for i, c in enumerate(key_cols))
+            pull_sql = "".join(f", T.\"{c}\"" for c in pull_cols)
+            rows = self.con.execute(
+                f"SELECT K.pos{pull_sql} FROM (SELECT {unnest_sql}) AS K JOIN {entry['table']} AS T ON {on_sql}",
+                key_lists,
+            ).fetchall()
+            found = {r[0]: dict(zip(pull_cols, r[1:])) for r in rows}
+            for pos, k in enumerate(missing):
+                results[k] = found.get(pos)
+                self._lookup_cache[(spec_key, pulls, k)] = results[k]
+            while len(self._lookup_cache) > self.lookup_cache_size:
+                self._lookup_cache.popitem(last=False)
+
+        return [results[k] for k in norm_keys]
+
+    def invalidate_results(self, path: Optional[str] = None) -> int:
+        """Drops memoized previews/outputs that read path (everything when path is None)."""
+        return self.results.invalidate(path) if self.results is not None else 0
+
+    def lookup_cache_stats(self) -> Dict:
+        """Hit/miss counters and size of the lookup result cache."""
+        return {"hits": self.lookup_hits, "misses": self.lookup_misses, "size": len(self._lookup_cache)}
 
     def cleanup(self):
-        """Closes connection and removes temp files."""
+        """Closes connection and removes this engine's own temp files."""
         try:
             self.con.close()
-            if os.path.exists(self.temp_dir):
+            if self.owns_connection and os.path.exists(self.temp_dir):
                 shutil.rmtree(self.temp_dir)
         except:
             pass
@@ -0,0 +1,197 @@
+import hashlib
+import multiprocessing
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+from staging import StagingCache # type: ignore
+from utils import get_file_fingerprint
+
+# Rows buffered per Parquet part while streaming a sheet
+CHUNK_ROWS = 50_000
+SHEET_COLUMN = "sheet_name"
+
+# Workbook fingerprint -> sheet names; every read of an .xlsx source needs its default
+# sheet, and opening the workbook costs far more than the cached Parquet read it resolves to
+_SHEETS: Dict[str, List[str]] = {}
+_SHEETS_MAX = 256
+_sheets_lock = threading.Lock()
+
+def list_sheets(path: str) -> List[str]:
+    """Sheet names of a workbook (read-only open, no cell data; cached per file fingerprint)."""
+    fingerprint = get_file_fingerprint(path)
+    with _sheets_lock:
+        if fingerprint in _SHEETS:
+            return list(_SHEETS[fingerprint])
+    from openpyxl import load_workbook # type: ignore
+    wb = load_workbook(path, read_only=True)
+    try:
+        sheets = list(wb.sheetnames)
+    finally:
+        wb.close()
+    if fingerprint:
+        with _sheets_lock:
+            if len(_SHEETS) >= _SHEETS_MAX:
+                _SHEETS.pop(next(iter(_SHEETS)))
+            _SHEETS[fingerprint] = sheets
+    return list(sheets)
+
+def _unique_names(header: tuple, width: int) -> List[str]:
+    names: List[str] = []
+    seen = set()
+    for i in range(width):
+        value = header[i] if i < len(header) else None
+        base = str(value).strip() if value is not None and str(value).strip() else f"column{i + 1}"
+        name, n = base, 1
+        while name in seen:
+            n += 1
+            name = f"{base}_{n}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+def _column_array(values: list):
+    """Arrow array with the inferred type; mixed-type columns fall back to strings."""
+    import pyarrow as pa # type: ignore
+    try:
+        arr = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+        arr = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    if pa.types.is_null(arr.type):
+        arr = arr.cast(pa.string())
+    return arr
+
+def _write_part(columns: List[list], names: List[str], path: str):
+    import pyarrow as pa # type: ignore
+    import pyarrow.parquet as pq # type: ignore
+    table = pa.Table.from_arrays([_column_array(col) for col in columns], names=names)
+    pq.write_table(table, path)
+
+def convert_sheet(path: str, sheet: str, header_row: int, out_path: str) -> int:
+    """
+    Streams one sheet to a Parquet file and returns its row count (runs in a worker process).
+    Rows are read with openpyxl's read-only parser and written in CHUNK_ROWS parts, which
+    DuckDB then merges by name so columns whose type changes between parts widen instead of failing.
+    """
+    import duckdb # type: ignore
+    from openpyxl import load_workbook # type: ignore
+
+    parts_dir = out_path + ".parts"
+    os.makedirs(parts_dir, exist_ok=True)
+    wb = load_workbook(path, read_only=True, data_only=True)
+    rows = 0
+    try:
+        it = wb[sheet].iter_rows(values_only=True)
+        header: tuple = ()
+        for _ in range(max(1, header_row)):
+            header = next(it, ())
+        width = len(header)
+        buffer: List[tuple] = []
+        part = 0
+
+        def flush():
+            nonlocal part
+            names = _unique_names(header, width)
+            columns = [[row[i] if i < len(row) else None for row in buffer] for i in range(width)]
+            _write_part(columns, names, os.path.join(parts_dir, f"part-{part:05d}.parquet"))
+            part += 1
+            buffer.clear()
+
+        for row in it:
+            if row is None or all(v is None for v in row):
+                continue
+            if len(row) > width:
+                # Rows wider than the header get generated names; earlier parts lack them (NULL)
+                width = len(row)
+            buffer.append(row)
+            rows += 1
+            if len(buffer) >= CHUNK_ROWS:
+                flush()
+        if buffer or part == 0:
+            flush()
+    finally:
+        wb.close()
+
+    con = duckdb.connect()
+    try:
+        glob_path = os.path.join(parts_dir, "*.parquet").replace("\\", "/")
+        con.execute(f"COPY (SELECT * FROM read_parquet('{glob_path}', union_by_name=true)) "
+                    f"TO '{out_path}' (FORMAT PARQUET)")
+    finally:
+        con.close()
+        shutil.rmtree(parts_dir, ignore_errors=True)
+    return rows
+
+class ExcelIngestor:
+    """
+    Converts .xlsx workbooks to Parquet in the staging cache, one worker process per sheet.
+    Entries are keyed by workbook fingerprint, sheet and header row, so a workbook is parsed
+    once and later reads (and joins) run at Parquet speed. Selecting several sheets yields one
+    table with a sheet_name column. Legacy .xls files are not supported by openpyxl.
+    """
+    def __init__(self, staging: StagingCache, max_workers: Optional[int] = None):
+        self.staging = staging
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    @staticmethod
+    def _key(fingerprint: str, sheets: List[str], header_row: int) -> str:
+        spec = f"{fingerprint}|{'|'.join(sheets)}|{header_row}"
+        return "xlsx_" + hashlib.sha1(spec.encode("utf-8")).hexdigest()
+
+    def ingest(self, path: str, sheets: Optional[List[str]] = None, header_row: int = 1) -> Optional[str]:
+        """Returns the cached Parquet path for the chosen sheets (default: the first sheet)."""
+        fingerprint = get_file_fingerprint(path)
+        if not fingerprint:
+            return None
+        sheets = list(sheets or list_sheets(path)[:1])
+        combined_key = self._key(fingerprint, sheets, header_row)
+        cached = self.staging.lookup_key(combined_key)
+        if cached:
+            return cached
+
+        keys = {sheet: self._key(fingerprint, [sheet], header_row) for sheet in sheets}
+        targets = {sheet: self.staging.entry_path(key) for sheet, key in keys.items()}
+        todo = [sheet for sheet in sheets if not self.staging.lookup_key(keys[sheet])]
+        tmp = {sheet: f"{targets[sheet]}.{os.getpid()}.{threading.get_ident()}.tmp" for sheet in todo}
+        try:
+            if len(todo) == 1:
+                convert_sheet(path, todo[0], header_row, tmp[todo[0]])
+            elif todo:
+                # Spawned, not forked: the calling process may hold a live multi-threaded DuckDB instance
+                with ProcessPoolExecutor(max_workers=min(len(todo), self.max_workers),
+                                         mp_context=multiprocessing.get_context("spawn")) as pool:
+                    futures = [pool.submit(convert_sheet, path, sheet, header_row, tmp[sheet]) for sheet in todo]
+                    for future in futures:
+                        future.result()
+            for sheet in todo:
+                os.replace(tmp[sheet], targets[sheet])
+        finally:
+            for sheet in todo:
+                if os.path.exists(tmp[sheet]):
+                    os.remove(tmp[sheet])
+
+        if len(sheets) == 1:
+            result = targets[sheets[0]]
+        else:
+            result = self._combine(sheets, targets, self.staging.entry_path(combined_key))
+        self.staging.evict(keep=result)
+        return result
+
+    def _combine(self, sheets: List[str], targets: dict, result: str) -> str:
+        import duckdb # type: ignore
+        selects = []
+        for sheet in sheets:
+            label = sheet.replace("'", "''")
+            selects.append(f"SELECT '{label}' AS {SHEET_COLUMN}, * FROM read_parquet('{targets[sheet]}')")
+        union = " UNION ALL BY NAME ".join(selects)
+        tmp_path = f"{result}.{os.getpid()}.{threading.get_ident()}.tmp"
+        con = duckdb.connect()
+        try:
+            con.execute(f"COPY ({union}) TO '{tmp_path}' (FORMAT PARQUET)")
+            os.replace(tmp_path, result)
+        finally:
+            con.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return result
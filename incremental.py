@@ -0,0 +1,208 @@
+import glob
+import hashlib
+import json
+import os
+import uuid
+from typing import Dict, List, Optional, Tuple
+from utils import get_file_fingerprint, is_dataset, source_format
+
+STATE_FILE = "_watermark.json"
+PART_EXTENSIONS = ('.csv', '.parquet', '.tsv', '.txt', '.xlsx', '.xls')
+# Uncompressed text masters: new rows are read from the byte offset where the last run stopped
+TAIL_EXTENSIONS = ('.csv', '.tsv', '.txt')
+# Reference keys that only label or describe the reference in the UI
+UI_KEYS = ('name', 'cols')
+
+class IncrementalRunner:
+    """
+    Incremental enrichment of append-only masters.
+    Remembers a watermark in output_dir/_watermark.json and only enriches what is new:
+      - a directory master: part files not seen before (by fingerprint)
+      - watermark_column: rows with a value above the previous maximum
+      - an uncompressed CSV/TSV master: the complete lines appended after the previous byte
+        offset, read alone with the column types of the first run (the history is never re-read)
+      - otherwise: rows beyond the previous row count
+    Each run appends a new output part. A change to any reference file or to the join
+    spec triggers a full rebuild, which only removes the parts and state this runner wrote;
+    a non-empty output_dir without a watermark file is never written to.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        # Temp copy of the current run's new lines (tail reads), removed after the run
+        self._tail_path: Optional[str] = None
+
+    def _load_state(self, output_dir: str) -> Optional[Dict]:
+        path = os.path.join(output_dir, STATE_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def _save_state(self, output_dir: str, state: Dict):
+        tmp_path = os.path.join(output_dir, STATE_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2, default=str)
+        os.replace(tmp_path, os.path.join(output_dir, STATE_FILE))
+
+    def _spec_hash(self, file_a: str, ref_files: List[Dict], output_format: str,
+                   master_cols: Optional[List[str]], watermark_column: Optional[str]) -> str:
+        spec = {
+            "master": os.path.abspath(file_a),
+            # Every join option (policy, key transforms, match type, ...) changes the output
+            "refs": [{**{k: v for k, v in r.items() if k not in UI_KEYS}, "path": os.path.abspath(r['path'])}
+                     for r in ref_files],
+            "format": output_format.lower(),
+            "master_cols": master_cols,
+            "watermark_column": watermark_column,
+        }
+        return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _clear(output_dir: str, state: Dict):
+        """Removes the parts listed in state and the state file (nothing else in output_dir)."""
+        for part in state.get("parts", []):
+            path = os.path.join(output_dir, os.path.basename(part))
+            if os.path.isfile(path):
+                os.remove(path)
+        state_path = os.path.join(output_dir, STATE_FILE)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+
+    @staticmethod
+    def master_parts(master_dir: str) -> List[str]:
+        """Supported part files of a directory master, in name order."""
+        files = glob.glob(os.path.join(master_dir, "**", "*"), recursive=True)
+        return sorted(f for f in files if os.path.isfile(f) and os.path.splitext(f)[1].lower() in PART_EXTENSIONS)
+
+    def _new_slice(self, file_a: str, state: Optional[Dict],
+                   watermark_column: Optional[str]) -> Tuple[Optional[str], object]:
+        """Returns (master source SQL for the new rows or None, next watermark)."""
+        con = self.engine.con
+        if os.path.isdir(file_a):
+            seen = set(state["watermark"]) if state else set()
+            current = {get_file_fingerprint(p): p for p in self.master_parts(file_a)}
+            new_parts = [p for fp, p in current.items() if fp not in seen]
+            if not new_parts:
+                return None, sorted(seen)
+            union = " UNION ALL BY NAME ".join(f"SELECT * FROM {self.engine._read_func(p)}" for p in new_parts)
+            return f"({union})", sorted(seen | set(current))
+
+        if watermark_column:
+            read_a = self.engine._read_func(file_a)
+            col = f"\"{watermark_column}\""
+            low = state["watermark"] if state else None
+            low_cond = f" WHERE {col} > '{low}'" if low is not None else ""
+            high = con.execute(f"SELECT MAX({col}) FROM {read_a}{low_cond}").fetchone()[0]
+            if high is None:
+                return None, low
+            cond = f"{col} <= '{high}'" + (f" AND {col} > '{low}'" if low is not None else "")
+            return f"(SELECT * FROM {read_a} WHERE {cond})", str(high)
+
+        ext, suffix = source_format(file_a)
+        if ext in TAIL_EXTENSIONS and suffix == ext and not is_dataset(file_a):
+            return self._new_tail(file_a, state)
+
+        # Row-count watermark: read the raw file in order (the staged copy is rebuilt on every append)
+        read_raw = self.engine._raw_read_func(file_a)
+        low = int(state["watermark"]) if state else 0
+        high = int(con.execute(f"SELECT COUNT(*) FROM {read_raw}").fetchone()[0])
+        if high <= low:
+            return None, low
+        return f"(SELECT * FROM {read_raw} LIMIT {high - low} OFFSET {low})", high
+
+    @staticmethod
+    def _complete_end(f, low: int, size: int) -> int:
+        """Offset just past the last newline in [low, size), or low (an appender may be mid-line)."""
+        pos = size
+        while pos > low:
+            start = max(low, pos - 2**16)
+            f.seek(start)
+            block = f.read(pos - start)
+            cut = block.rfind(b"\n")
+            if cut >= 0:
+                return start + cut + 1
+            pos = start
+        return low
+
+    def _new_tail(self, file_a: str, state: Optional[Dict]) -> Tuple[Optional[str], Dict]:
+        """
+        New lines of an append-only text master. The watermark holds the byte offset after the
+        last line read and the column types of the first run; only the bytes past the offset are
+        copied (behind the header) to a temp file and read, so a run costs the new rows only.
+        """
+        watermark = dict(state["watermark"]) if state else {"offset": None, "types": None}
+        with open(file_a, "rb") as f:
+            header = f.readline()
+            low = watermark["offset"] if watermark["offset"] is not None else len(header)
+            high = self._complete_end(f, low, os.path.getsize(file_a))
+            if high <= low:
+                return None, watermark
+            ext = os.path.splitext(file_a)[1]
+            self._tail_path = os.path.join(self.engine.temp_dir, f"tail_{uuid.uuid4().hex[:8]}{ext}")
+            with open(self._tail_path, "wb") as out:
+                out.write(header if header.endswith(b"\n") else header + b"\n")
+                f.seek(low)
+                remaining = high - low
+                while remaining:
+                    block = f.read(min(8 * 2**20, remaining))
+                    out.write(block)
+                    remaining -= len(block)
+        read_tail = self.engine._raw_read_func(self._tail_path, types=watermark["types"])
+        if not watermark["types"]:
+            # Later slices keep the first run's types, so every part has the same schema
+            watermark["types"] = self.engine._column_types(read_tail)
+        return f"(SELECT * FROM {read_tail})", {**watermark, "offset": high}
+
+    def run(self,
+            file_a: str,
+            ref_files: List[Dict],
+            output_dir: str,
+            output_format: str = 'csv',
+            watermark_column: Optional[str] = None,
+            master_cols: Optional[List[str]] = None):
+        """Enriches only the master rows added since the last run and writes them as a new part."""
+        spec = self._spec_hash(file_a, ref_files, output_format, master_cols, watermark_column)
+        ref_fps = {os.path.abspath(r['path']): get_file_fingerprint(r['path']) for r in ref_files}
+        state = self._load_state(output_dir)
+
+        rebuild = state is None or state.get("spec") != spec or state.get("refs") != ref_fps
+        if rebuild:
+            if state is None:
+                if os.path.isdir(output_dir) and os.listdir(output_dir):
+                    return False, (f"Output directory '{output_dir}' is not empty and has no {STATE_FILE}; "
+                                   f"choose an empty or new directory.")
+            else:
+                self._clear(output_dir, state)
+            state = None
+        os.makedirs(output_dir, exist_ok=True)
+
+        con = self.engine.con
+        try:
+            # Row slicing with LIMIT/OFFSET needs the file's row order
+            con.execute("SET preserve_insertion_order=true")
+            master_source, watermark = self._new_slice(file_a, state, watermark_column)
+            parts = list(state["parts"]) if state else []
+            if master_source is None:
+                return True, "Up to date: no new master rows."
+
+            ext = "parquet" if output_format.lower() == 'parquet' else "csv"
+            part_name = f"part-{len(parts):05d}.{ext}"
+            query = self.engine._generate_multi_join_query(file_a, ref_files, master_source=master_source,
+                                                           master_cols=master_cols)
+            options = self.engine._copy_options(output_format)
+            con.execute(f"COPY ({query}) TO '{os.path.join(output_dir, part_name)}' ({options})")
+            parts.append(part_name)
+        except Exception as e:
+            return False, f"SQL Error: {str(e)}"
+        finally:
+            con.execute("SET preserve_insertion_order=false")
+            if self._tail_path and os.path.exists(self._tail_path):
+                os.remove(self._tail_path)
+            self._tail_path = None
+
+        self._save_state(output_dir, {"spec": spec, "refs": ref_fps, "watermark": watermark, "parts": parts})
+        kind = "Full rebuild" if rebuild else "Incremental run"
+        return True, f"{kind} complete: wrote {part_name}."
@@ -0,0 +1,186 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from engine import LookupEngine # type: ignore
+from staging import StagingCache # type: ignore
+from memo import ResultCache # type: ignore
+from utils import get_path_size
+
+def _output_paths(output_path: str) -> List[str]:
+    """The output file plus the tmp_ file DuckDB writes to before renaming it."""
+    directory, name = os.path.split(output_path)
+    return [output_path, os.path.join(directory, f"tmp_{name}")]
+
+class JoinJob:
+    """A single chain-join run executed on its own engine and DuckDB connection."""
+    def __init__(self, job_id: str, file_a: str, ref_files: List[Dict], output_path: str,
+                 output_format: str, join_kwargs: Dict):
+        self.job_id = job_id
+        self.file_a = file_a
+        self.ref_files = ref_files
+        self.output_path = output_path
+        self.output_format = output_format
+        self.join_kwargs = join_kwargs
+        self.status = "queued"
+        self.message = ""
+        self.rows_total = 0
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.engine: Optional[LookupEngine] = None
+        self.cancel_requested = False
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def progress(self) -> Dict:
+        """Snapshot of status, percent, estimated rows scanned, elapsed seconds and bytes written."""
+        percent = 100.0 if self.status == "done" else 0.0
+        engine = self.engine
+        buckets = None
+        if self.status == "running" and engine is not None:
+            try:
+                percent = max(float(engine.con.query_progress()), 0.0)
+            except Exception:
+                pass
+            if engine.partitioned is not None:
+                # Partitioned runs: whole buckets done plus the running bucket's query progress
+                buckets = dict(engine.partitioned.progress)
+                total = max(buckets["buckets_total"], 1)
+                if buckets["stage"] == "partitioning":
+                    percent = 0.0
+                elif buckets["stage"] == "joining":
+                    percent = min(100.0, (buckets["buckets_done"] + percent / 100.0) / total * 100.0)
+        elapsed = 0.0
+        if self.started:
+            elapsed = (self.finished or time.time()) - self.started
+        bytes_written = sum(get_path_size(path) for path in _output_paths(self.output_path))
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "message": self.message,
+            "percent": percent,
+            "rows_scanned": int(self.rows_total * percent / 100.0),
+            "rows_total": self.rows_total,
+            "elapsed": elapsed,
+            "bytes_written": bytes_written,
+            "buckets": buckets,
+        }
+
+class JobRunner:
+    """
+    Runs chain joins in the background with live progress and cancellation.
+    Every job gets its own LookupEngine (own connection and temp subdirectory under temp_root)
+    limited to threads / memory_limit; the Parquet staging cache and result cache are shared.
+    With shared (an engine on a persistent registry database), jobs instead run on cursors of
+    that engine's instance: a second connect to the registry file would join the same instance,
+    and per-job SETs would change its spill directory and budgets for every session.
+    """
+    def __init__(self, temp_root: str = "duckdb_jobs", cache_dir: Optional[str] = "duckdb_cache",
+                 max_workers: int = 1, registry_path: Optional[str] = None,
+                 threads: Optional[int] = None, memory_limit: Optional[str] = None,
+                 staging: Optional[StagingCache] = None, extension_dir: Optional[str] = None,
+                 result_cache: Optional[ResultCache] = None, shared: Optional[LookupEngine] = None):
+        self.shared = shared
+        self.temp_root = temp_root
+        self.registry_path = registry_path
+        self.cache_dir = cache_dir
+        self.threads = threads
+        self.memory_limit = memory_limit
+        self.staging = staging
+        self.extension_dir = extension_dir
+        self.result_cache = result_cache
+        self.jobs: Dict[str, JoinJob] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="lookup-job")
+
+    def submit(self, file_a: str, ref_files: List[Dict], output_path: str,
+               output_format: str = 'csv', **join_kwargs) -> str:
+        """Queues a join spec and returns its job id."""
+        job = JoinJob(uuid.uuid4().hex[:12], file_a, ref_files, output_path, output_format, join_kwargs)
+        with self._lock:
+            self.jobs[job.job_id] = job
+        self._pool.submit(self._run, job)
+        return job.job_id
+
+    def get(self, job_id: str) -> Optional[JoinJob]:
+        return self.jobs.get(job_id)
+
+    def progress(self, job_id: str) -> Dict:
+        job = self.get(job_id)
+        return job.progress() if job else {}
+
+    def cancel(self, job_id: str) -> bool:
+        """Interrupts a running job (or drops a queued one)."""
+        job = self.get(job_id)
+        if job is None or job.done:
+            return False
+        job.cancel_requested = True
+        engine = job.engine
+        if engine is not None:
+            try:
+                engine.con.interrupt()
+            except Exception:
+                pass
+        return True
+
+    def _run(self, job: JoinJob):
+        if job.cancel_requested:
+            job.status, job.message = "cancelled", "Cancelled before start."
+            return
+        job.started = time.time()
+        job.status = "running"
+        if self.shared is not None:
+            engine = LookupEngine(temp_dir=self.shared.temp_dir, con=self.shared.con.cursor(), staging=self.staging,
+                                  registry_path=self.registry_path, extension_dir=self.extension_dir,
+                                  result_cache=self.result_cache)
+        else:
+            engine = LookupEngine(temp_dir=self.temp_root, cache_dir=self.cache_dir, registry_path=self.registry_path,
+                                  threads=self.threads, memory_limit=self.memory_limit, staging=self.staging,
+                                  extension_dir=self.extension_dir, result_cache=self.result_cache)
+        job.engine = engine
+        try:
+            # A cancel may arrive before the engine was attached or interrupt the row count
+            if not job.cancel_requested:
+                try:
+                    job.rows_total = engine.count_rows(job.file_a)
+                except Exception:
+                    job.rows_total = 0
+            if job.cancel_requested:
+                success, msg = False, ""
+            else:
+                success, msg = engine.execute_multi_join(job.file_a, job.ref_files, job.output_path,
+                                                         job.output_format, **job.join_kwargs)
+            if job.cancel_requested:
+                job.status, job.message = "cancelled", "Job cancelled."
+                self._remove_output(job.output_path)
+            elif success:
+                job.status, job.message = "done", msg
+            else:
+                job.status, job.message = "failed", msg
+        except Exception as e:
+            job.status, job.message = "failed", str(e)
+        finally:
+            job.finished = time.time()
+            job.engine = None
+            engine.cleanup()
+
+    def _remove_output(self, output_path: str):
+        for path in _output_paths(output_path):
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except Exception:
+                pass
+
+    def shutdown(self):
+        """Cancels outstanding jobs and stops the worker pool."""
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,78 @@
+from typing import Dict, List, Optional, Union
+
+# Declarable per match pair via ref['key_transforms'] (one entry per pair; a name, a list of names, or None)
+KEY_TRANSFORMS = ('cast', 'trim', 'lower', 'strip_zeros')
+
+NUMERIC_TYPES = ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT',
+                 'UINTEGER', 'UBIGINT', 'UHUGEINT', 'FLOAT', 'DOUBLE', 'DECIMAL')
+STRING_TYPES = ('VARCHAR', 'CHAR', 'TEXT', 'STRING')
+TEMPORAL_TYPES = ('DATE', 'TIME', 'TIMESTAMP')
+
+def type_family(duck_type: str) -> str:
+    """Groups a DuckDB type name into numeric / string / temporal / other."""
+    base = (duck_type or "").upper().split('(')[0].strip()
+    if base in NUMERIC_TYPES:
+        return "numeric"
+    if base in STRING_TYPES:
+        return "string"
+    if base.startswith(TEMPORAL_TYPES):
+        return "temporal"
+    return "other"
+
+def common_type(left: str, right: str) -> str:
+    """Type both sides are cast to by the 'cast' transform."""
+    if left == right:
+        return left
+    lf, rf = type_family(left), type_family(right)
+    if lf == rf == "numeric":
+        floating = any(t.upper().startswith(('FLOAT', 'DOUBLE', 'DECIMAL')) for t in (left, right))
+        return "DOUBLE" if floating else "HUGEINT"
+    return "VARCHAR"
+
+def transforms_for(ref: Dict) -> List[List[str]]:
+    """Per-pair list of declared transforms for a reference."""
+    declared = ref.get('key_transforms') or []
+    result = []
+    for j in range(len(ref['match_pairs'])):
+        t: Union[str, List[str], None] = declared[j] if j < len(declared) else None
+        names = [t] if isinstance(t, str) else list(t or [])
+        for name in names:
+            if name not in KEY_TRANSFORMS:
+                raise ValueError(f"Unknown key transform '{name}' (expected one of {', '.join(KEY_TRANSFORMS)})")
+        result.append(names)
+    return result
+
+def key_expr(col_sql: str, transforms: List[str], cast_type: Optional[str] = None) -> str:
+    """Wraps a column reference in the declared normalization transforms, applied in order."""
+    expr = col_sql
+    for name in transforms:
+        if name == 'cast':
+            expr = f"TRY_CAST({expr} AS {cast_type or 'VARCHAR'})"
+        elif name == 'trim':
+            expr = f"trim(CAST({expr} AS VARCHAR))"
+        elif name == 'lower':
+            expr = f"lower(CAST({expr} AS VARCHAR))"
+        elif name == 'strip_zeros':
+            # '007' -> '7', '000' -> '0'
+            expr = f"regexp_replace(trim(CAST({expr} AS VARCHAR)), '^0+(.)', '\\1')"
+    return expr
+
+def key_type_warnings(master_types: Dict[str, str], ref_types: Dict[str, str], ref: Dict, alias: str) -> List[str]:
+    """Explains match pairs whose inferred types cannot be joined reliably without a transform."""
+    warnings = []
+    for (m_col, r_col), names in zip(ref['match_pairs'], transforms_for(ref)):
+        if m_col not in master_types:
+            warnings.append(f"{alias}: anchor key '{m_col}' not found in master")
+            continue
+        if r_col not in ref_types:
+            warnings.append(f"{alias}: registry key '{r_col}' not found in {ref['path']}")
+            continue
+        if names:
+            continue
+        m_type, r_type = master_types[m_col], ref_types[r_col]
+        m_family, r_family = type_family(m_type), type_family(r_type)
+        if m_family != r_family:
+            hint = "'strip_zeros' or 'cast'" if "numeric" in (m_family, r_family) else "'cast'"
+            warnings.append(f"{alias}: '{m_col}' ({m_type}) vs '{r_col}' ({r_type}) would be cast on every "
+                            f"comparison and may fail or miss matches; declare {hint}")
+    return warnings
@@ -1,9 +1,15 @@
 import streamlit as st # type: ignore
 import os
+import json
+import shutil
 import time
-import pandas as pd # type: ignore
-from engine import LookupEngine # type: ignore
-from utils import format_bytes, get_file_info
+from engine import MATCH_POLICIES, MATCH_TYPES # type: ignore
+from pool import EnginePool # type: ignore
+from store import UploadStore # type: ignore
+from keys import KEY_TRANSFORMS # type: ignore
+from profiling import report_path # type: ignore
+from matchstats import stats_path # type: ignore
+from utils import format_bytes, get_file_info, is_multi_file_output, zip_output
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -255,21 +261,185 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- SESSION STATE ---
+@st.cache_resource
+def get_pool() -> EnginePool:
+    """One engine pool (shared DuckDB instance, staging cache and job runner) per server process."""
+    return EnginePool()
+
+@st.cache_resource
+def get_store() -> UploadStore:
+    return UploadStore("uploads")
+
 if 'engine' not in st.session_state:
-    st.session_state.engine = LookupEngine()
+    st.session_state.engine = get_pool().session_engine()
+
+if 'jobs' not in st.session_state:
+    st.session_state.jobs = get_pool().jobs
+
+if 'store' not in st.session_state:
+    st.session_state.store = get_store()
 
 if 'main_data' not in st.session_state:
     st.session_state.main_data = {"path": "", "cols": []}
 if 'ref_list' not in st.session_state:
     st.session_state.ref_list = []
 
+def render_match_stats(output_path):
+    """Shows per-reference match counts and null rates from the stats sidecar."""
+    path = stats_path(output_path)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        stats = json.load(f)
+    refs = stats.get("references", {})
+    if not refs:
+        return
+    stat_cols = st.columns(len(refs))
+    for sc, (alias, ref) in zip(stat_cols, refs.items()):
+        sc.metric(f"{alias} matched", f"{ref['match_rate']:.1%}", f"{ref['unmatched']:,} unmatched", delta_color="off")
+    import pandas as pd # type: ignore # deferred: only needed once a result exists
+    null_rows = [{"column": col, "null_rate": rate} for ref in refs.values() for col, rate in ref["null_rate"].items()]
+    if null_rows:
+        st.dataframe(pd.DataFrame(null_rows), use_container_width=True)
+
+def render_run_report(output_path):
+    """Shows the per-stage / per-operator breakdown saved next to a profiled result."""
+    path = report_path(output_path)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    import pandas as pd # type: ignore
+    with st.expander("⏱️ RUN BREAKDOWN", expanded=False):
+        totals = report.get("totals", {})
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Query Time", f"{totals.get('latency') or 0:.2f}s")
+        m2.metric("Peak Memory", format_bytes(totals.get("peak_memory")))
+        m3.metric("Spilled", format_bytes(totals.get("spilled_bytes")))
+        m4.metric("Rows Scanned", f"{totals.get('rows_scanned') or 0:,}")
+        st.markdown('<p class="secondary-text">Stages (s)</p>', unsafe_allow_html=True)
+        st.bar_chart(pd.Series(report.get("stages", {}), name="seconds"))
+        st.markdown('<p class="secondary-text">Operator time (s)</p>', unsafe_allow_html=True)
+        st.bar_chart(pd.Series(report.get("time_by_operator_type", {}), name="seconds"))
+        if report.get("joins"):
+            st.dataframe(pd.DataFrame(report["joins"]), use_container_width=True)
+        if report.get("plan"):
+            st.code(report["plan"])
+
+# Served by Streamlit's static route (server.enableStaticServing, see .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Streamlit refuses static files above 200 MB; larger files stay on disk only
+STATIC_MAX_BYTES = 190 * 2**20
+# Published downloads are removed after this long (the outputs themselves stay in results/)
+STATIC_TTL_SECONDS = 24 * 3600
+
+def expire_published(max_age=STATIC_TTL_SECONDS):
+    """Removes published download directories older than max_age seconds."""
+    root = os.path.join(STATIC_DIR, "results")
+    if not os.path.isdir(root):
+        return
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def publish_output(job):
+    """
+    Exposes a finished output under the static route so the browser downloads it straight
+    from disk (st.download_button would hold the whole file in server memory).
+    Files are hard-linked, so nothing is duplicated; a directory output is also offered as
+    one zip when it fits the static size limit. Files over STATIC_MAX_BYTES are listed
+    without a URL. Returns [(file name, url or None, size)].
+    """
+    expire_published()
+    target = os.path.join(STATIC_DIR, "results", job["id"])
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target)
+    if os.path.isdir(job["path"]):
+        files = []
+        for root, _, names in os.walk(job["path"]):
+            files.extend(os.path.join(root, n) for n in names)
+        files.sort()
+    else:
+        files = [job["path"]]
+    published = []
+    for src in files:
+        # Partitioned outputs nest key=value directories; flatten them into the file name
+        name = os.path.relpath(src, job["path"]).replace(os.sep, "__") if os.path.isdir(job["path"]) else job["name"]
+        size = os.path.getsize(src)
+        if size > STATIC_MAX_BYTES:
+            published.append((name, None, size))
+            continue
+        dst = os.path.join(target, name)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+        published.append((name, f"app/static/results/{job['id']}/{name}", size))
+    if os.path.isdir(job["path"]) and sum(size for _, _, size in published) <= STATIC_MAX_BYTES:
+        name = f"{os.path.basename(job['path'].rstrip(os.sep))}.zip"
+        archive = zip_output(job["path"], os.path.join(target, name))
+        published.insert(0, (name, f"app/static/results/{job['id']}/{name}", os.path.getsize(archive)))
+    return published
+
+@st.fragment(run_every=1.0)
+def render_job_status():
+    """Polls the active compile job without blocking the rest of the page."""
+    job = st.session_state.active_job
+    prog = st.session_state.jobs.progress(job["id"])
+    if not prog:
+        return
+    if prog["status"] in ("queued", "running"):
+        st.progress(min(prog["percent"], 100.0) / 100.0,
+                    text=f"Quantum Sync {prog['percent']:.1f}% · ~{prog['rows_scanned']:,} / {prog['rows_total']:,} rows · "
+                         f"{prog['elapsed']:.1f}s · {format_bytes(prog['bytes_written'])} written")
+        if st.button("⛔ CANCEL COMPILE", use_container_width=True, key=f"cancel_{job['id']}"):
+            st.session_state.jobs.cancel(job["id"])
+    elif prog["status"] == "done":
+        st.success(f"Compilation Finished! ({prog['elapsed']:.2f}s)")
+        render_match_stats(job["path"])
+        render_run_report(job["path"])
+        if "downloads" not in job:
+            job["downloads"] = publish_output(job)
+        links = "<br>".join(f'<a href="{url}" download="{name}">📥 {name}</a> ({format_bytes(size)})'
+                            for name, url, size in job["downloads"] if url)
+        st.markdown(f'<div style="max-height: 250px; overflow-y: auto;">{links}</div>', unsafe_allow_html=True)
+        too_large = [name for name, url, _ in job["downloads"] if not url]
+        if too_large:
+            st.caption(f"{len(too_large)} file(s) exceed the {format_bytes(STATIC_MAX_BYTES)} browser download limit "
+                       f"and are only on the server under `{os.path.abspath(job['path'])}`. "
+                       f"Set 'Split Files At' (e.g. 150MB) to download them as separate parts.")
+    elif prog["status"] == "cancelled":
+        st.warning(prog["message"])
+    else:
+        st.error(prog["message"])
+
 def save_file(uploaded_file):
-    if not os.path.exists("uploads"):
-        os.makedirs("uploads")
-    path = os.path.join("uploads", uploaded_file.name)
-    with open(path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    return path
+    return st.session_state.store.save(uploaded_file)
+
+def detect_columns(path):
+    return st.session_state.store.get_columns(path, st.session_state.engine.get_columns)
+
+def excel_source(path, key):
+    """For .xlsx uploads: sheet / header-row pickers; returns the converted (cached) Parquet path."""
+    if not path.lower().endswith(".xlsx"):
+        return path
+    engine = st.session_state.engine
+    try:
+        sheets = engine.excel_sheets(path)
+    except ImportError:
+        return path
+    s1, s2 = st.columns([3, 1])
+    chosen = s1.multiselect("Sheets", sheets, default=sheets[:1], key=f"sheets_{key}")
+    header_row = s2.number_input("Header Row", min_value=1, value=1, step=1, key=f"header_{key}")
+    if not chosen:
+        return path
+    with st.spinner("Converting workbook to Parquet..."):
+        return engine.ingest_excel(path, chosen, int(header_row)) or path
 
 # ─────────────────────────────────────────────
 # HERO HEADER
@@ -305,9 +475,9 @@ with col1:
     u_main = st.file_uploader("Ingest Master File", type=["csv", "xlsx", "parquet"], key="umain", label_visibility="collapsed")
     
     if u_main:
-        m_path = save_file(u_main)
+        m_path = excel_source(save_file(u_main), "main")
         if st.session_state.main_data["path"] != m_path:
-            st.session_state.main_data["cols"] = st.session_state.engine.get_columns(m_path)
+            st.session_state.main_data["cols"] = detect_columns(m_path)
             st.session_state.main_data["path"] = m_path
         
         cols = st.session_state.main_data["cols"]
@@ -328,9 +498,9 @@ with col2:
         temp_list = []
         total_size = 0
         for ur in u_refs:
-            r_path = save_file(ur)
+            r_path = excel_source(save_file(ur), ur.name)
             total_size += os.path.getsize(r_path)
-            r_cols = st.session_state.engine.get_columns(r_path)
+            r_cols = detect_columns(r_path)
             temp_list.append({"path": r_path, "name": ur.name, "cols": r_cols})
         st.session_state.ref_list = temp_list
         
@@ -371,10 +541,24 @@ if st.session_state.main_data["cols"] and st.session_state.ref_list:
                     m_key = st.selectbox("Anchor Key", st.session_state.main_data["cols"], key=f"mkey_{i}")
                 with sub2:
                     r_key = st.selectbox("Registry Key", ref['cols'], key=f"rkey_{i}")
+                key_norm = st.multiselect("Key Normalization", list(KEY_TRANSFORMS), key=f"knorm_{i}")
             with c2:
                 st.markdown('<p class="ref-header" style="font-size: 0.75rem; text-transform: uppercase;">Schema Pull</p>', unsafe_allow_html=True)
                 pull = st.multiselect("Attributes", ref['cols'], key=f"pull_{i}")
-            chain_data.append({'path': ref['path'], 'match_pairs': [(m_key, r_key)], 'pull_cols': pull})
+                policy = st.selectbox("Duplicate Keys", list(MATCH_POLICIES), key=f"policy_{i}")
+                order_by = st.selectbox("Latest By", ref['cols'], key=f"order_{i}") if policy == "latest" else None
+                match_type = st.selectbox("Match Type", list(MATCH_TYPES), key=f"mtype_{i}")
+                temporal = {}
+                if match_type != "equal":
+                    temporal['time_col'] = st.selectbox("Anchor Time", st.session_state.main_data["cols"], key=f"mtime_{i}")
+                    temporal['valid_from'] = st.selectbox("Valid From", ref['cols'], key=f"vfrom_{i}")
+                    if match_type == "interval":
+                        temporal['valid_to'] = st.selectbox("Valid To", ref['cols'], key=f"vto_{i}")
+            chain_data.append({'path': ref['path'], 'match_pairs': [(m_key, r_key)], 'pull_cols': pull, 'key_transforms': [key_norm],
+                               'match_policy': policy, 'order_by': order_by, 'match_type': match_type, **temporal})
+
+    for warning in st.session_state.engine.validate_keys(st.session_state.main_data["path"], chain_data):
+        st.warning(f"⚠️ {warning}")
 
     st.write("")
 
@@ -395,31 +579,65 @@ if st.session_state.main_data["cols"] and st.session_state.ref_list:
     _, mid, _ = st.columns([1, 2, 1])
     with mid:
         st.markdown('<p class="master-header" style="font-size: 1rem; margin-bottom: 1.5rem; text-transform: uppercase; text-align: center;">Compilation Settings</p>', unsafe_allow_html=True)
+        carry_cols = st.multiselect("Carry Master Columns (empty = all)", st.session_state.main_data["cols"], key="carry_cols")
         c1, c2 = st.columns(2)
         with c1:
             out_name = st.text_input("Object Path", value="enriched_data.csv")
         with c2:
             out_fmt = st.radio("Encoding Protocol", ["csv", "parquet"], horizontal=True)
+        with st.expander("🧩 OUTPUT LAYOUT", expanded=False):
+            out_cols = (carry_cols or st.session_state.main_data["cols"]) + [f"R{i}_{c}" for i, ref in enumerate(chain_data) for c in ref['pull_cols']]
+            o1, o2 = st.columns(2)
+            with o1:
+                part_cols = st.multiselect("Partition By", out_cols, key="part_cols")
+                split_size = st.text_input("Split Files At (e.g. 500MB, blank = single file)", value="", key="split_size")
+                per_thread = st.checkbox("Parallel Per-Thread Files", key="per_thread")
+            with o2:
+                codec_choices = ["snappy", "zstd", "gzip", "uncompressed"] if out_fmt == "parquet" else ["none", "gzip", "zstd"]
+                codec = st.selectbox("Compression", codec_choices, key=f"codec_{out_fmt}")
+                row_group = st.number_input("Row Group Size", min_value=0, value=0, step=10000, key="row_group", disabled=out_fmt != "parquet")
+        write_options = {
+            "partition_by": part_cols,
+            "file_size_bytes": split_size.strip() or None,
+            "per_thread_output": per_thread,
+            "compression": None if codec == "none" else codec,
+            "row_group_size": int(row_group) or None,
+        }
+        
+        force = st.checkbox("Recompute (bypass result cache)", key="force_recompute")
         
         st.write("")
         if st.button("👁️ PREVIEW COMPILED OBJECT", use_container_width=True):
             with st.spinner("Processing preview..."):
-                prev = st.session_state.engine.get_multi_preview(st.session_state.main_data["path"], chain_data)
+                prev, rates = st.session_state.engine.get_sampled_preview(st.session_state.main_data["path"], chain_data, master_cols=carry_cols or None, use_cache=not force)
                 if prev is not None: st.dataframe(prev, use_container_width=True)
+                _, fanout = st.session_state.engine.check_fanout(chain_data)
+                for warning in fanout:
+                    st.warning(f"💥 {warning}")
+                for warning in st.session_state.engine.check_intervals(chain_data):
+                    st.warning(f"⏳ {warning}")
+                if rates:
+                    rate_cols = st.columns(len(rates))
+                    for rc, (alias, rate) in zip(rate_cols, rates.items()):
+                        rc.metric(f"{alias} est. match rate", f"{rate:.0%}")
         
         st.write("")
         if st.button("⚡ INITIALIZE GLOBAL COMPILE", use_container_width=True):
             if not os.path.exists("results"): os.makedirs("results")
             final_path = os.path.join("results", out_name)
-            with st.status("Quantum Sync Initiated...", expanded=True) as status:
-                start = time.time()
-                success, msg = st.session_state.engine.execute_multi_join(st.session_state.main_data["path"], chain_data, final_path, out_fmt)
-                elapsed = time.time() - start
-                if success:
-                    status.update(label=f"Compilation Finished! ({elapsed:.2f}s)", state="complete")
-                    st.balloons()
-                    with open(final_path, "rb") as f:
-                        st.download_button(label="📥 DOWNLOAD RESULTS", data=f, file_name=out_name, mime="text/csv" if out_fmt == "csv" else "application/octet-stream", use_container_width=True)
-                else:
-                    status.update(label="System Overflow", state="error")
-                    st.error(msg)
+            if is_multi_file_output(write_options):
+                # Directory of parts: drop the file extension from the target, and never
+                # write into a directory that already holds files
+                final_path = os.path.splitext(final_path)[0]
+                if os.path.isdir(final_path) and os.listdir(final_path):
+                    final_path = f"{final_path}_{time.strftime('%Y%m%d_%H%M%S')}"
+            previous = st.session_state.get("active_job")
+            if previous:
+                shutil.rmtree(os.path.join(STATIC_DIR, "results", previous["id"]), ignore_errors=True)
+            st.session_state.active_job = {
+                "id": st.session_state.jobs.submit(st.session_state.main_data["path"], chain_data, final_path, out_fmt, master_cols=carry_cols or None, write_options=write_options, profile=True, use_cache=not force),
+                "path": final_path, "name": out_name, "fmt": out_fmt,
+            }
+
+        if st.session_state.get("active_job"):
+            render_job_status()
@@ -0,0 +1,64 @@
+import json
+from typing import Dict, List
+
+MATCH_FLAG = "__matched"
+
+def stats_path(output_path: str) -> str:
+    """Match statistics sidecar location: next to the result file."""
+    return output_path.rstrip("/\\") + ".stats.json"
+
+def flag_column(alias: str) -> str:
+    """Output-side name of the per-reference match indicator (dropped before writing)."""
+    return f"__{alias}{MATCH_FLAG}"
+
+class MatchStats:
+    """
+    Accumulates per-reference match counts and pulled-column null counts over the
+    record batches of the enriched result as they are written.
+    """
+    def __init__(self, pulled: Dict[str, List[str]]):
+        # alias -> output column names pulled from that reference
+        self.pulled = pulled
+        self.rows = 0
+        self.matched = {alias: 0 for alias in pulled}
+        self.nulls = {alias: {col: 0 for col in cols} for alias, cols in pulled.items()}
+
+    def update(self, batch):
+        """Counts one Arrow record batch (null counts come from Arrow metadata)."""
+        n = batch.num_rows
+        self.rows += n
+        for alias, cols in self.pulled.items():
+            self.matched[alias] += n - batch.column(flag_column(alias)).null_count
+            for col in cols:
+                self.nulls[alias][col] += batch.column(col).null_count
+
+    def merge(self, other: "MatchStats"):
+        """Adds the counts of another MatchStats over the same references (e.g. one bucket)."""
+        self.rows += other.rows
+        for alias in self.pulled:
+            self.matched[alias] += other.matched.get(alias, 0)
+            for col in self.nulls[alias]:
+                self.nulls[alias][col] += other.nulls.get(alias, {}).get(col, 0)
+
+    def summary(self) -> Dict:
+        refs = {}
+        for alias, cols in self.pulled.items():
+            matched = self.matched[alias]
+            refs[alias] = {
+                "matched": matched,
+                "unmatched": self.rows - matched,
+                "match_rate": matched / self.rows if self.rows else 0.0,
+                "null_rate": {col: (self.nulls[alias][col] / self.rows if self.rows else 0.0) for col in cols},
+            }
+        return {"rows": self.rows, "references": refs}
+
+    def describe(self) -> str:
+        parts = [f"{alias}: {ref['match_rate']:.1%} matched ({ref['matched']:,}/{self.rows:,})"
+                 for alias, ref in self.summary()["references"].items()]
+        return "; ".join(parts)
+
+    def save(self, output_path: str) -> str:
+        path = stats_path(output_path)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        return path
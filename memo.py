@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from utils import get_file_fingerprint
+from matchstats import stats_path # type: ignore
+from profiling import report_path # type: ignore
+
+# Bump when query generation changes so persisted entries from older code are ignored
+CACHE_VERSION = 1
+INDEX_FILE = "index.json"
+
+def _sidecars(output_path: str) -> List[str]:
+    return [stats_path(output_path), report_path(output_path)]
+
+class ResultCache:
+    """
+    Memoizes join results by a canonical hash of the join spec, the fingerprint of every
+    input and the output options.
+      - previews: kept in memory (LRU, bounded by max_preview_bytes)
+      - outputs: indexed on disk (cache_dir/index.json, LRU, bounded by max_entries); a hit
+        returns the existing output, copying it when a different output path is requested
+    The spec fully determines the generated SQL for given inputs, so it is hashed instead of
+    the SQL itself (generating the SQL needs the planner's statistics scans).
+    Inputs without a fingerprint (in-memory sources) are never cached.
+    """
+    def __init__(self, cache_dir: str = "duckdb_cache/results", max_entries: int = 256,
+                 max_preview_bytes: int = 64 * 2**20):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_preview_bytes = max_preview_bytes
+        self._lock = threading.Lock()
+        self._previews: "OrderedDict[str, Tuple[Any, Dict, int, List[str]]]" = OrderedDict()
+        self._preview_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # --- keys ---
+
+    @staticmethod
+    def _inputs(file_a: str, ref_files: List[Dict]) -> Optional[Dict[str, str]]:
+        inputs = {}
+        for path in [file_a] + [ref['path'] for ref in ref_files]:
+            fingerprint = get_file_fingerprint(path)
+            if not fingerprint:
+                return None
+            inputs[os.path.abspath(path)] = fingerprint
+        return inputs
+
+    def key(self, kind: str, file_a: str, ref_files: List[Dict], **options) -> Optional[str]:
+        """Canonical cache key, or None when an input cannot be fingerprinted."""
+        inputs = self._inputs(file_a, ref_files)
+        if inputs is None:
+            return None
+        refs = [{k: v for k, v in ref.items() if k not in ('name', 'cols')} for ref in ref_files]
+        spec = {"version": CACHE_VERSION, "kind": kind, "master": os.path.abspath(file_a),
+                "refs": refs, "inputs": inputs, "options": options}
+        return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    # --- previews ---
+
+    @staticmethod
+    def _size_of(result: Any) -> int:
+        if hasattr(result, "nbytes"):
+            return int(result.nbytes)
+        if hasattr(result, "memory_usage"):
+            return int(result.memory_usage(deep=True).sum())
+        return 0
+
+    def get_preview(self, key: Optional[str]):
+        """Returns (preview, match_rates) or None."""
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._previews.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._previews.move_to_end(key)
+            self.hits += 1
+        result, rates, _, _ = entry
+        # DataFrames are mutable; hand out a copy so callers cannot alter the cached one
+        return (result.copy() if hasattr(result, "copy") else result), dict(rates)
+
+    def put_preview(self, key: Optional[str], result: Any, rates: Dict, inputs: List[str]):
+        if key is None or result is None:
+            return
+        size = self._size_of(result)
+        if size > self.max_preview_bytes:
+            return
+        with self._lock:
+            if key in self._previews:
+                self._preview_bytes -= self._previews.pop(key)[2]
+            self._previews[key] = (result, dict(rates), size, [os.path.abspath(p) for p in inputs])
+            self._preview_bytes += size
+            while self._preview_bytes > self.max_preview_bytes and self._previews:
+                _, evicted = self._previews.popitem(last=False)
+                self._preview_bytes -= evicted[2]
+
+    # --- outputs ---
+
+    def _index_path(self) -> str:
+        return os.path.join(self.cache_dir, INDEX_FILE)
+
+    def _load_index(self) -> Dict[str, Dict]:
+        try:
+            with open(self._index_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def _save_index(self, index: Dict[str, Dict]):
+        # Several processes may share the cache; write atomically (last writer wins)
+        tmp_path = f"{self._index_path()}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2, default=str)
+        os.replace(tmp_path, self._index_path())
+
+    def get_output(self, key: Optional[str], output_path: str) -> Optional[Dict]:
+        """
+        Returns the cached entry when its output still exists unchanged, placing it at
+        output_path first if the result was written elsewhere.
+        """
+        if key is None:
+            return None
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(key)
+            if not entry or get_file_fingerprint(entry["output_path"]) != entry["output_fingerprint"]:
+                if entry:
+                    del index[key]
+                    self._save_index(index)
+                self.misses += 1
+                return None
+            if os.path.abspath(output_path) != os.path.abspath(entry["output_path"]):
+                self._copy(entry["output_path"], output_path)
+            entry["used"] = time.time()
+            self._save_index(index)
+            self.hits += 1
+            return entry
+
+    @staticmethod
+    def _copy(source: str, target: str):
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        if os.path.isdir(source):
+            shutil.copytree(source, target)
+        else:
+            shutil.copyfile(source, target)
+        for src, dst in zip(_sidecars(source), _sidecars(target)):
+            if os.path.exists(src):
+                shutil.copyfile(src, dst)
+
+    def put_output(self, key: Optional[str], output_path: str, message: str, inputs: List[str],
+                   match_stats: Optional[Dict] = None):
+        if key is None:
+            return
+        fingerprint = get_file_fingerprint(output_path)
+        if not fingerprint:
+            return
+        with self._lock:
+            index = self._load_index()
+            index[key] = {"output_path": os.path.abspath(output_path), "output_fingerprint": fingerprint,
+                          "message": message, "match_stats": match_stats or {},
+                          "inputs": [os.path.abspath(p) for p in inputs], "used": time.time()}
+            for old in sorted(index, key=lambda k: index[k]["used"])[:max(0, len(index) - self.max_entries)]:
+                del index[old]
+            self._save_index(index)
+
+    # --- invalidation ---
+
+    def invalidate(self, path: Optional[str] = None) -> int:
+        """Drops every entry reading path (all entries when path is None); returns how many."""
+        target = os.path.abspath(path) if path else None
+        removed = 0
+        with self._lock:
+            for key in list(self._previews):
+                if target is None or target in self._previews[key][3]:
+                    self._preview_bytes -= self._previews.pop(key)[2]
+                    removed += 1
+            index = self._load_index()
+            for key in list(index):
+                if target is None or target in index[key]["inputs"]:
+                    del index[key]
+                    removed += 1
+            self._save_index(index)
+        return removed
+
+    def clear(self) -> int:
+        return self.invalidate(None)
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "previews": len(self._previews),
+                "preview_bytes": self._preview_bytes, "outputs": len(self._load_index())}
@@ -0,0 +1,267 @@
+import multiprocessing
+import os
+import re
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from keys import common_type, key_expr, type_family # type: ignore
+from matchstats import MatchStats # type: ignore
+from profiling import enable_profiling, load_profile # type: ignore
+
+BUCKET_COLUMN = "__bucket"
+
+_UNITS = {"": 1, "B": 1, "KB": 10**3, "MB": 10**6, "GB": 10**9, "TB": 10**12,
+          "KIB": 2**10, "MIB": 2**20, "GIB": 2**30, "TIB": 2**40}
+
+def _parse_bytes(text: str) -> Optional[int]:
+    """'12.4 GiB' -> bytes (DuckDB setting format)."""
+    match = re.match(r"\s*([\d.]+)\s*([A-Za-z]*)", text or "")
+    if not match or match.group(2).upper() not in _UNITS:
+        return None
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+def _join_bucket(task: Dict) -> Tuple[int, Optional[MatchStats]]:
+    """Process-pool entry point: joins one bucket on a fresh connection."""
+    from engine import LookupEngine # type: ignore
+    engine = LookupEngine(temp_dir=task["temp_dir"], cache_dir=None,
+                          threads=task["threads"], memory_limit=task["memory_limit"])
+    try:
+        return task["bucket"], _write_bucket(engine, task)
+    finally:
+        engine.cleanup()
+
+def _write_bucket(engine, task: Dict) -> Optional[MatchStats]:
+    if task.get("profile_path"):
+        enable_profiling(engine.con, task["profile_path"])
+    try:
+        if task["collect_stats"]:
+            return engine._write_with_stats(task["query"], task["ref_files"], task["part_path"], task["output_format"],
+                                            task["write_options"], header=task["header"])
+        options = engine._copy_options(task["output_format"], task["write_options"])
+        if not task["header"]:
+            options = options.replace("HEADER", "HEADER false", 1)
+        engine.con.execute(f"COPY ({task['query']}) TO '{task['part_path']}' ({options})")
+        return None
+    finally:
+        if task.get("profile_path"):
+            engine.con.execute("PRAGMA disable_profiling")
+
+class PartitionedJoin:
+    """
+    Out-of-core chain join by explicit hash partitioning.
+    The master and every reference keyed on the partition column are written to disk in
+    `buckets` Parquet partitions of hash(normalized key) % buckets; each bucket is then joined
+    on its own (serially or in a process pool with separate connections) and the bucket outputs
+    are concatenated. Peak memory is bounded by the largest bucket instead of the whole build.
+    CSV buckets are written with the output's compression and only the first with a header,
+    so they concatenate byte for byte; Parquet compression and row groups are applied when
+    the bucket files are combined.
+    References that do not join on the partition column (or normalize it differently) are
+    projected once and joined in full against every bucket.
+    With profile=True each bucket join is profiled on its own connection; the profiles are
+    kept in bucket_profiles (bucket -> DuckDB JSON profile).
+    """
+    def __init__(self, engine, buckets: int = 16, workers: int = 1, profile: bool = False):
+        self.engine = engine
+        self.buckets = max(1, int(buckets))
+        self.workers = max(1, int(workers))
+        self.profile = profile
+        self.bucket_profiles: Dict[int, Dict] = {}
+        self.progress: Dict = {"stage": "queued", "buckets_total": self.buckets, "buckets_done": 0,
+                               "bucket_seconds": {}}
+
+    @staticmethod
+    def partition_column(ref_files: List[Dict]) -> str:
+        """Master anchor column shared by the most references (first one on ties)."""
+        counts: Dict[str, int] = {}
+        for ref in ref_files:
+            for m_col in dict.fromkeys(p[0] for p in ref['match_pairs']):
+                counts[m_col] = counts.get(m_col, 0) + 1
+        if not counts:
+            raise ValueError("Partitioned mode needs at least one equality match pair")
+        return max(counts, key=lambda c: (counts[c], -list(counts).index(c)))
+
+    def _expr_type(self, expr: str, source: str) -> str:
+        return self.engine.con.execute(f"DESCRIBE SELECT {expr} AS k FROM {source}").fetchone()[1]
+
+    def _bucket_exprs(self, read_a: str, ref_files: List[Dict], m_col: str) -> Tuple[str, Dict[int, str]]:
+        """
+        Bucket expressions for the master and for each partitioned reference (by index).
+        All sides hash the key after the same normalization, cast to one common type, so
+        equal keys land in the same bucket.
+        """
+        engine = self.engine
+        canon: Optional[Tuple] = None
+        sides: Dict[int, Tuple[str, str]] = {}
+        m_expr_sql = None
+        for i, ref in enumerate(ref_files):
+            read_ref = engine._ref_read_func(ref)
+            specs = engine._key_specs(ref, read_a, read_ref)
+            for (pm, pr), (names, cast_type) in zip(ref['match_pairs'], specs):
+                if pm != m_col:
+                    continue
+                spec = (tuple(names), cast_type)
+                if canon is None:
+                    canon = spec
+                    m_expr_sql = key_expr(f"\"{m_col}\"", names, cast_type)
+                if spec == canon:
+                    sides[i] = (key_expr(f"\"{pr}\"", names, cast_type), read_ref)
+                break
+
+        m_type = self._expr_type(m_expr_sql, read_a)
+        target = m_type
+        for i in list(sides):
+            r_type = self._expr_type(*sides[i])
+            if type_family(r_type) != type_family(m_type):
+                print(f"Partition warning: R{i} key type {r_type} vs master {m_type}; joined in full per bucket")
+                del sides[i]
+                continue
+            target = common_type(target, r_type)
+
+        def bucket(expr: str) -> str:
+            return f"hash(CAST({expr} AS {target})) % {self.buckets}"
+        return bucket(m_expr_sql), {i: bucket(expr) for i, (expr, _) in sides.items()}
+
+    def _partition(self, source: str, columns: str, bucket_expr: str, target_dir: str):
+        self.engine.con.execute(
+            f"COPY (SELECT {columns}, {bucket_expr} AS {BUCKET_COLUMN} FROM {source}) "
+            f"TO '{target_dir}' (FORMAT PARQUET, PARTITION_BY ({BUCKET_COLUMN}), OVERWRITE true)"
+        )
+
+    @staticmethod
+    def _bucket_source(target_dir: str, bucket: int) -> Optional[str]:
+        part_dir = os.path.join(target_dir, f"{BUCKET_COLUMN}={bucket}")
+        if not os.path.isdir(part_dir):
+            return None
+        return f"read_parquet('{part_dir}/*.parquet', hive_partitioning=false)"
+
+    def run(self, file_a: str, ref_files: List[Dict], output_path: str, output_format: str = 'csv',
+            master_cols: Optional[List[str]] = None, collect_stats: bool = True,
+            write_options: Optional[Dict] = None) -> Tuple[MatchStats, Dict[str, float]]:
+        """Partitions, joins every bucket and concatenates into output_path. Returns (stats, stage timings)."""
+        engine = self.engine
+        work_dir = os.path.join(engine.temp_dir, f"partitioned_{uuid.uuid4().hex[:8]}")
+        stages: Dict[str, float] = {}
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            start = time.time()
+            self.progress["stage"] = "partitioning"
+            read_a = engine._read_func(file_a)
+            m_col = self.partition_column(ref_files)
+            m_bucket, ref_buckets = self._bucket_exprs(read_a, ref_files, m_col)
+
+            master_dir = os.path.join(work_dir, "master")
+            if master_cols:
+                anchors = engine._anchor_columns(ref_files)
+                m_columns = ", ".join(f"\"{c}\"" for c in dict.fromkeys(list(master_cols) + anchors))
+            else:
+                m_columns = "*"
+            self._partition(read_a, m_columns, m_bucket, master_dir)
+
+            ref_dirs: Dict[int, str] = {}
+            whole: Dict[int, str] = {}
+            for i, ref in enumerate(ref_files):
+                columns = ", ".join(f"\"{c}\"" for c in engine._ref_columns(ref))
+                read_ref = engine._ref_read_func(ref)
+                ref_dirs[i] = os.path.join(work_dir, f"r{i}")
+                if i in ref_buckets:
+                    self._partition(read_ref, columns, ref_buckets[i], ref_dirs[i])
+                else:
+                    os.makedirs(ref_dirs[i], exist_ok=True)
+                    whole_path = os.path.join(ref_dirs[i], "all.parquet")
+                    engine.con.execute(f"COPY (SELECT {columns} FROM {read_ref}) TO '{whole_path}' (FORMAT PARQUET)")
+                    whole[i] = f"read_parquet('{whole_path}')"
+            stages['partitioning'] = time.time() - start
+
+            start = time.time()
+            self.progress["stage"] = "joining"
+            is_parquet = output_format.lower() == 'parquet'
+            ext = "parquet" if is_parquet else "csv"
+            tasks = []
+            for b in range(self.buckets):
+                master_source = self._bucket_source(master_dir, b)
+                if master_source is None:
+                    self.progress["buckets_done"] += 1
+                    continue
+                ref_sources = []
+                for i in range(len(ref_files)):
+                    if i in whole:
+                        ref_sources.append(whole[i])
+                    else:
+                        empty = f"(SELECT * FROM read_parquet('{ref_dirs[i]}/*/*.parquet', hive_partitioning=false) LIMIT 0)"
+                        ref_sources.append(self._bucket_source(ref_dirs[i], b) or empty)
+                query = engine._generate_multi_join_query(file_a, ref_files, master_source, ref_sources,
+                                                          master_cols=master_cols, match_flags=collect_stats)
+                tasks.append({"bucket": b, "query": query, "ref_files": ref_files, "output_format": output_format,
+                              "part_path": os.path.join(work_dir, f"bucket-{b:05d}.{ext}"),
+                              "collect_stats": collect_stats, "temp_dir": os.path.join(work_dir, "spill"),
+                              "write_options": None if is_parquet else write_options, "header": not tasks,
+                              "profile_path": os.path.join(work_dir, f"profile-{b:05d}.json") if self.profile else None})
+
+            stats = MatchStats(engine._pulled_columns(ref_files))
+            for b, part_stats in self._run_tasks(tasks):
+                if part_stats is not None:
+                    stats.merge(part_stats)
+            stages['join_buckets'] = time.time() - start
+            for task in tasks:
+                profile = load_profile(task["profile_path"]) if task["profile_path"] else None
+                if profile:
+                    self.bucket_profiles[task["bucket"]] = profile
+
+            start = time.time()
+            self.progress["stage"] = "concatenating"
+            self._concatenate([t["part_path"] for t in tasks], output_path, output_format, write_options)
+            stages['concatenate'] = time.time() - start
+            self.progress["stage"] = "done"
+            return stats, stages
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _run_tasks(self, tasks: List[Dict]):
+        """Yields (bucket, stats) as buckets finish, updating per-bucket progress."""
+        if self.workers == 1 or len(tasks) <= 1:
+            for task in tasks:
+                self.progress["current_bucket"] = task["bucket"]
+                start = time.time()
+                result = _write_bucket(self.engine, task)
+                self.progress["bucket_seconds"][task["bucket"]] = time.time() - start
+                self.progress["buckets_done"] += 1
+                yield task["bucket"], result
+            return
+
+        con = self.engine.con
+        threads = int(con.execute("SELECT current_setting('threads')").fetchone()[0])
+        memory = _parse_bytes(con.execute("SELECT current_setting('memory_limit')").fetchone()[0])
+        for task in tasks:
+            task["threads"] = max(1, threads // self.workers)
+            task["memory_limit"] = f"{memory // self.workers // 2**20}MB" if memory else None
+        started = time.time()
+        # Spawned, not forked: the parent holds a live multi-threaded DuckDB instance
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_join_bucket, task) for task in tasks]
+            for future in as_completed(futures):
+                bucket, result = future.result()
+                self.progress["bucket_seconds"][bucket] = time.time() - started
+                self.progress["buckets_done"] += 1
+                yield bucket, result
+
+    def _concatenate(self, parts: List[str], output_path: str, output_format: str,
+                     write_options: Optional[Dict] = None):
+        """
+        Joins bucket outputs into one file: one streaming DuckDB pass for Parquet (applying
+        compression/row_group_size), byte append for CSV (compressed parts form a valid
+        multi-member gzip/zstd stream).
+        """
+        if output_format.lower() == 'parquet':
+            if not parts:
+                raise ValueError("Master produced no rows to join")
+            files = ", ".join(f"'{p}'" for p in parts)
+            options = self.engine._copy_options(output_format, write_options)
+            self.engine.con.execute(f"COPY (SELECT * FROM read_parquet([{files}])) TO '{output_path}' ({options})")
+            return
+        with open(output_path, "wb") as out:
+            for part in parts:
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, out, 8 * 2**20)
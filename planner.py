@@ -0,0 +1,101 @@
+import json
+import os
+from typing import Dict, List, Tuple
+from utils import format_bytes
+
+SAMPLE_ROWS = 100_000
+
+class JoinPlanner:
+    """
+    Cheap cost-based planning for the reference chain.
+    Gathers per-reference statistics (row count, sampled key distinct count, file size),
+    merges references that read the same file on the same keys into a single build,
+    and orders builds from smallest to largest estimated hash-table size.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+
+    def reference_stats(self, ref: Dict) -> Dict:
+        """Row count (metadata for Parquet/registry tables), sampled key distinct count and sizes."""
+        con = self.engine.con
+        read_ref = self.engine._ref_read_func(ref)
+        # asof/interval builds hold every version of a key, so the validity start counts too
+        key_cols = [pair[1] for pair in ref['match_pairs']] + self.engine._temporal_columns(ref)[:1]
+        keys = ", ".join(f"\"{c}\"" for c in key_cols)
+        rows = int(con.execute(f"SELECT COUNT(*) FROM {read_ref}").fetchone()[0])
+        sample, distinct = con.execute(
+            f"SELECT COUNT(*), approx_count_distinct(({keys})) FROM (SELECT {keys} FROM {read_ref} LIMIT {SAMPLE_ROWS})"
+        ).fetchone()
+        total_cols = max(len(self.engine._column_types(read_ref)), 1)
+        needed = len(set([pair[1] for pair in ref['match_pairs']] + list(ref['pull_cols'])))
+        file_size = self.engine.source_bytes(ref['path'])
+        return {
+            "rows": rows,
+            "sample_rows": int(sample),
+            "sample_distinct_keys": int(distinct or 0),
+            "duplication": (sample / distinct) if distinct else 1.0,
+            "file_size": file_size,
+            # Projected share of the file that ends up in the hash table
+            "build_bytes": int(file_size * min(needed / total_cols, 1.0)),
+        }
+
+    @staticmethod
+    def _build_key(ref: Dict) -> str:
+        return json.dumps({
+            "path": os.path.abspath(ref['path']),
+            "match_pairs": [list(p) for p in ref['match_pairs']],
+            "key_transforms": ref.get('key_transforms'),
+            "match_policy": ref.get('match_policy') or 'all',
+            "order_by": ref.get('order_by'),
+            "match_type": ref.get('match_type') or 'equal',
+            "time_col": ref.get('time_col'),
+            "valid_from": ref.get('valid_from'),
+            "valid_to": ref.get('valid_to'),
+        }, sort_keys=True, default=str)
+
+    def plan(self, ref_files: List[Dict]) -> Tuple[List[Dict], str]:
+        """
+        Returns (planned builds, printable plan). Each build is a ref_files entry with
+        'alias' (R{first original index}) and 'outputs' [(original alias, column)], so
+        output column names stay R{i}_col regardless of the chosen order.
+        """
+        builds: Dict[str, Dict] = {}
+        for i, ref in enumerate(ref_files):
+            key = self._build_key(ref)
+            if key not in builds:
+                build = dict(ref)
+                build['alias'] = f"R{i}"
+                build['pull_cols'] = []
+                build['outputs'] = []
+                build['sources'] = []
+                builds[key] = build
+            build = builds[key]
+            build['sources'].append(f"R{i}")
+            for col in ref['pull_cols']:
+                if col not in build['pull_cols']:
+                    build['pull_cols'].append(col)
+                build['outputs'].append((f"R{i}", col))
+
+        planned = list(builds.values())
+        for build in planned:
+            try:
+                build['stats'] = self.reference_stats(build)
+            except Exception as e:
+                print(f"Planner warning: {e}")
+                build['stats'] = {"rows": 0, "build_bytes": 0, "duplication": 1.0, "file_size": 0}
+        planned.sort(key=lambda b: (b['stats']['build_bytes'], b['stats']['rows']))
+        return planned, self.describe(planned)
+
+    @staticmethod
+    def describe(planned: List[Dict]) -> str:
+        lines = ["Join plan (smallest build first):"]
+        for step, build in enumerate(planned, 1):
+            stats = build['stats']
+            merged = f" merged {'+'.join(build['sources'])}" if len(build['sources']) > 1 else ""
+            keys = ", ".join(f"{p[0]}={p[1]}" for p in build['match_pairs'])
+            lines.append(
+                f"  {step}. {build['alias']}{merged}: {os.path.basename(build['path'])} on {keys} | "
+                f"{stats['rows']:,} rows, ~{format_bytes(stats['build_bytes'])} build, "
+                f"key dup x{stats.get('duplication', 1.0):.2f}"
+            )
+        return "\n".join(lines)
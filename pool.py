@@ -0,0 +1,66 @@
+import os
+import threading
+from typing import Optional
+from engine import LookupEngine # type: ignore
+from jobs import JobRunner # type: ignore
+from utils import MEMORY_FRACTION, get_total_memory
+
+class EnginePool:
+    """
+    Process-wide engine pool.
+    Interactive sessions get cursors over one shared DuckDB instance (shared staging and
+    result caches, extensions and spill directory); background jobs each get their own engine and temp
+    subdirectory, with the thread and memory budgets divided across max_jobs.
+    With registry_path, jobs run on cursors of the shared instance as well (the registry file
+    can only back one instance), so they share the sessions' spill directory and budget.
+    """
+    def __init__(self,
+                 temp_root: str = "duckdb_temp",
+                 cache_dir: Optional[str] = "duckdb_cache",
+                 total_threads: Optional[int] = None,
+                 total_memory: Optional[int] = None,
+                 max_jobs: int = 2,
+                 registry_path: Optional[str] = None,
+                 extension_dir: Optional[str] = None):
+        self.temp_root = temp_root
+        self.registry_path = registry_path
+        self.max_jobs = max(1, max_jobs)
+        total_threads = total_threads or os.cpu_count() or 1
+        total_memory = total_memory or get_total_memory()
+
+        # Sessions and jobs split the machine: one share for sessions, one per job
+        shares = self.max_jobs + 1
+        self.threads = max(1, total_threads // shares)
+        self.memory_limit = f"{int(total_memory * MEMORY_FRACTION) // shares // 2**20}MB" if total_memory else None
+
+        self.base = LookupEngine(temp_dir=os.path.join(temp_root, "sessions"), cache_dir=cache_dir,
+                                 threads=self.threads, memory_limit=self.memory_limit,
+                                 registry_path=registry_path, extension_dir=extension_dir)
+        self.staging = self.base.staging
+        self.results = self.base.results
+        self.jobs = JobRunner(temp_root=os.path.join(temp_root, "jobs"), cache_dir=cache_dir,
+                              max_workers=self.max_jobs, registry_path=registry_path,
+                              threads=self.threads, memory_limit=self.memory_limit, staging=self.staging,
+                              extension_dir=extension_dir, result_cache=self.results,
+                              shared=self.base if registry_path else None)
+        self._lock = threading.Lock()
+        self.sessions = 0
+
+    def session_engine(self) -> LookupEngine:
+        """A LookupEngine on its own cursor of the shared instance (own temp tables, shared settings)."""
+        with self._lock:
+            engine = LookupEngine(temp_dir=self.base.temp_dir, con=self.base.con.cursor(), staging=self.staging,
+                                  registry_path=self.registry_path, extension_dir=self.base.extension_dir,
+                                  result_cache=self.results)
+            self.sessions += 1
+        return engine
+
+    def release(self, engine: LookupEngine):
+        """Closes a session engine's cursor; the shared instance stays open."""
+        engine.cleanup()
+        with self._lock:
+            self.sessions = max(0, self.sessions - 1)
+
+    def shutdown(self):
+        self.jobs.shutdown()
+        self.base.cleanup()
@@ -0,0 +1,118 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+def report_path(output_path: str) -> str:
+    """Run report location: next to the result file (or partition directory)."""
+    return output_path.rstrip("/\\") + ".report.json"
+
+def _flatten(node: Dict, depth: int, out: List[Dict]):
+    extra = node.get("extra_info") or {}
+    children = node.get("children") or []
+    out.append({
+        "depth": depth,
+        "operator": node.get("operator_name") or node.get("operator_type"),
+        "type": node.get("operator_type"),
+        "time": float(node.get("operator_timing") or 0.0),
+        "rows_in": [int(c.get("operator_cardinality") or 0) for c in children],
+        "rows_out": int(node.get("operator_cardinality") or 0),
+        "rows_scanned": int(node.get("operator_rows_scanned") or 0),
+        "detail": extra.get("Join Type") or extra.get("Table") or extra.get("Function") or "",
+        "conditions": extra.get("Conditions", ""),
+    })
+    for child in children:
+        _flatten(child, depth + 1, out)
+
+def build_run_report(profile: Optional[Dict], stages: Dict[str, float], extra: Optional[Dict] = None) -> Dict:
+    """
+    Structured run report from DuckDB's JSON profile plus Python-side stage timings.
+    Joins list probe/build input rows (children 0/1) and output rows per hash join.
+    """
+    operators: List[Dict] = []
+    totals: Dict = {}
+    if profile:
+        for child in profile.get("children") or []:
+            _flatten(child, 0, operators)
+        totals = {
+            "latency": profile.get("latency"),
+            "cpu_time": profile.get("cpu_time"),
+            "peak_memory": profile.get("system_peak_buffer_memory"),
+            "spilled_bytes": profile.get("system_peak_temp_dir_size"),
+            "bytes_read": profile.get("total_bytes_read"),
+            "bytes_written": profile.get("total_bytes_written"),
+            "rows_scanned": profile.get("cumulative_rows_scanned"),
+        }
+
+    joins = []
+    for op in operators:
+        if "JOIN" in (op["type"] or ""):
+            rows_in = op["rows_in"] + [0, 0]
+            joins.append({"operator": op["operator"], "join_type": op["detail"], "conditions": op["conditions"],
+                          "probe_rows": rows_in[0], "build_rows": rows_in[1], "rows_out": op["rows_out"],
+                          "time": op["time"]})
+
+    by_type: Dict[str, float] = {}
+    for op in operators:
+        by_type[op["type"] or "OTHER"] = by_type.get(op["type"] or "OTHER", 0.0) + op["time"]
+
+    report = {
+        "stages": stages,
+        "totals": totals,
+        "time_by_operator_type": dict(sorted(by_type.items(), key=lambda kv: -kv[1])),
+        "joins": joins,
+        "operators": operators,
+    }
+    if extra:
+        report.update(extra)
+    return report
+
+def build_partitioned_report(bucket_profiles: Dict[int, Dict], stages: Dict[str, float],
+                             extra: Optional[Dict] = None) -> Dict:
+    """
+    Run report for a partitioned join: one profile per bucket join, aggregated.
+    Joins and operators carry their bucket number; times, rows and bytes are summed over
+    buckets and peak memory/spill is the largest single bucket. Partitioning and concatenation
+    are only covered by the stage timings.
+    """
+    report = build_run_report(None, stages, extra)
+    totals: Dict = {}
+    for bucket, profile in sorted(bucket_profiles.items()):
+        part = build_run_report(profile, {})
+        for key in ("joins", "operators"):
+            report[key].extend({**item, "bucket": bucket} for item in part[key])
+        for op_type, seconds in part["time_by_operator_type"].items():
+            report["time_by_operator_type"][op_type] = report["time_by_operator_type"].get(op_type, 0.0) + seconds
+        for key, value in part["totals"].items():
+            if value is None:
+                continue
+            if key in ("peak_memory", "spilled_bytes"):
+                totals[key] = max(totals.get(key) or 0, value)
+            else:
+                totals[key] = (totals.get(key) or 0) + value
+    report["totals"] = totals
+    report["time_by_operator_type"] = dict(sorted(report["time_by_operator_type"].items(), key=lambda kv: -kv[1]))
+    report["buckets_profiled"] = len(bucket_profiles)
+    return report
+
+def enable_profiling(con, path: str):
+    """Detailed JSON profiling of the queries run on con, written to path."""
+    con.execute("SET enable_profiling='json'")
+    con.execute("SET profiling_mode='detailed'")
+    con.execute(f"SET profiling_output='{path}'")
+
+def load_profile(path: str) -> Optional[Dict]:
+    """Reads a DuckDB JSON profiling file, if one was written."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Profile read warning: {e}")
+        return None
+
+def save_run_report(report: Dict, output_path: str) -> str:
+    path = report_path(output_path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    return path
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from utils import get_file_fingerprint
+
+class ReferenceRegistry:
+    """
+    Persistent store of reference registries inside an on-disk DuckDB database.
+    Each source file is loaded once per key set as a typed table sorted on those keys
+    and is only reloaded when the file's fingerprint (path/size/mtime) changes; references
+    joining the same file on different keys get separate tables.
+    """
+    META_TABLE = "registry_tables"
+    # Shared across engines in one process, which all see the same database instance
+    _lock = threading.Lock()
+
+    def __init__(self, con):
+        self.con = con
+        with self._lock:
+            self.con.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.META_TABLE} (
+                    path VARCHAR,
+                    key_cols VARCHAR,
+                    table_name VARCHAR,
+                    fingerprint VARCHAR,
+                    row_count BIGINT,
+                    loaded_at DOUBLE,
+                    PRIMARY KEY (path, key_cols)
+                )
+            """)
+
+    @staticmethod
+    def table_name(path: str, key_cols: List[str]) -> str:
+        spec = json.dumps([os.path.abspath(path), list(key_cols)])
+        return "ref_" + hashlib.sha1(spec.encode("utf-8")).hexdigest()[:16]
+
+    def _meta(self, path: str, key_cols: List[str]) -> Optional[Dict]:
+        row = self.con.execute(
+            f"SELECT table_name, fingerprint FROM {self.META_TABLE} WHERE path = ? AND key_cols = ?",
+            [os.path.abspath(path), json.dumps(list(key_cols))],
+        ).fetchone()
+        if not row:
+            return None
+        return {"table_name": row[0], "fingerprint": row[1]}
+
+    def ensure(self, path: str, key_cols: List[str], read_stmt: Callable[[], str]) -> Optional[str]:
+        """
+        Returns the registry table for a source sorted on key_cols, (re)loading it if the
+        source changed. read_stmt is only called when a (re)load is needed.
+        Returns None when the source is missing.
+        """
+        fingerprint = get_file_fingerprint(path)
+        if not fingerprint:
+            return None
+        with self._lock:
+            meta = self._meta(path, key_cols)
+            if meta and meta["fingerprint"] == fingerprint:
+                return meta["table_name"]
+            table = self.table_name(path, key_cols)
+            order = ", ".join(f"\"{c}\"" for c in key_cols)
+            self.con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {read_stmt()} ORDER BY {order}")
+            row_count = self.con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            self.con.execute(
+                f"INSERT OR REPLACE INTO {self.META_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+                [os.path.abspath(path), json.dumps(list(key_cols)), table, fingerprint, row_count, time.time()],
+            )
+            return table
+
+    def sources(self) -> List[Dict]:
+        """Lists tracked references for UI/CLI feedback."""
+        rows = self.con.execute(
+            f"SELECT path, table_name, row_count, key_cols, loaded_at FROM {self.META_TABLE} ORDER BY path, key_cols"
+        ).fetchall()
+        return [{"path": r[0], "table_name": r[1], "row_count": r[2], "key_cols": json.loads(r[3]),
+                 "loaded_at": r[4]} for r in rows]
+
+    def drop(self, path: str):
+        """Removes every table loaded from a reference file and their tracking rows."""
+        with self._lock:
+            tables = self.con.execute(f"SELECT table_name FROM {self.META_TABLE} WHERE path = ?",
+                                      [os.path.abspath(path)]).fetchall()
+            for (table,) in tables:
+                self.con.execute(f"DROP TABLE IF EXISTS {table}")
+            self.con.execute(f"DELETE FROM {self.META_TABLE} WHERE path = ?", [os.path.abspath(path)])
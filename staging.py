@@ -0,0 +1,112 @@
+import duckdb # type: ignore
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+from utils import get_file_fingerprint
+
+class StagingCache:
+    """
+    On-disk Parquet staging area for raw CSV/XLSX inputs.
+    Each source is converted once, keyed by its path/size/mtime fingerprint,
+    and the least recently used entries are evicted once the cache exceeds max_bytes.
+    """
+    def __init__(self, cache_dir: str = "duckdb_cache", max_bytes: int = 20 * 2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # One lock per fingerprint: staging a large source never blocks other sources
+        self._source_locks: Dict[str, threading.Lock] = {}
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def entry_path(self, fingerprint: str) -> str:
+        return os.path.join(self.cache_dir, f"{fingerprint}.parquet")
+
+    def _touch(self, path: str):
+        """Marks an entry as recently used (mtime doubles as the LRU clock)."""
+        try:
+            os.utime(path, None)
+        except Exception:
+            pass
+
+    def lookup(self, file_path: str) -> Optional[str]:
+        """Returns the staged Parquet path for a source if it is already cached."""
+        fingerprint = get_file_fingerprint(file_path)
+        if not fingerprint:
+            return None
+        return self.lookup_key(fingerprint)
+
+    def lookup_key(self, key: str) -> Optional[str]:
+        """Returns a cached entry by key (fingerprint or derived key), marking it as used."""
+        target = self.entry_path(key)
+        if os.path.exists(target):
+            self._touch(target)
+            return target
+        return None
+
+    def stage(self, con, file_path: str, read_stmt: Callable[[], str]) -> Optional[str]:
+        """
+        Converts a source to typed Parquet once and returns the cached path.
+        read_stmt is only called on a miss, so cache hits never need the source reader.
+        Concurrent callers for the same source wait for one conversion; other sources
+        stage in parallel (each writer uses its own tmp file and an atomic rename).
+        """
+        fingerprint = get_file_fingerprint(file_path)
+        if not fingerprint:
+            return None
+        target = self.entry_path(fingerprint)
+        with self._lock:
+            source_lock = self._source_locks.setdefault(fingerprint, threading.Lock())
+        with source_lock:
+            if os.path.exists(target):
+                self._touch(target)
+                return target
+            tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                con.execute(f"COPY (SELECT * FROM {read_stmt()}) TO '{tmp_path}' (FORMAT PARQUET)")
+                os.replace(tmp_path, target)
+            except Exception as e:
+                if os.path.exists(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except Exception:
+                        pass
+                if isinstance(e, duckdb.InterruptException):
+                    raise  # cancelled: do not fall back to reading the raw source
+                print(f"Staging warning: {e}")
+                return None
+        with self._lock:
+            self.evict(keep=target)
+        return target
+
+    def _entries(self) -> List[str]:
+        return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.parquet')]
+
+    def size(self) -> int:
+        """Total bytes currently held by staged entries."""
+        return sum(os.path.getsize(p) for p in self._entries())
+
+    def evict(self, keep: Optional[str] = None):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        total = sum(os.path.getsize(p) for p in entries)
+        for path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                total -= size
+            except Exception:
+                # Entry may still be open by a running scan; retry on the next eviction.
+                pass
+
+    def clear(self):
+        """Drops every staged entry."""
+        for path in self._entries():
+            try:
+                os.remove(path)
+            except Exception:
+                pass
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+CHUNK_SIZE = 8 * 2**20
+
+class UploadStore:
+    """
+    Content-addressed store for uploaded files.
+    Uploads are hashed while streamed to disk in chunks, identical content is
+    stored once, and the detected schema is cached per content hash.
+    """
+    def __init__(self, root: str = "uploads"):
+        self.root = root
+        self._lock = threading.Lock()
+        # upload identity -> stored path, so reruns skip re-hashing entirely
+        self._seen: Dict[str, str] = {}
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+    def _upload_key(self, uploaded_file) -> str:
+        file_id = getattr(uploaded_file, "file_id", None) or getattr(uploaded_file, "id", "")
+        return f"{file_id}|{uploaded_file.name}|{uploaded_file.size}"
+
+    def _schema_path(self, digest: str) -> str:
+        return os.path.join(self.root, f"{digest}.schema.json")
+
+    @staticmethod
+    def digest_of(path: str) -> str:
+        """Content hash of a stored file (its basename without extension)."""
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def save(self, uploaded_file) -> str:
+        """Streams an upload to disk once and returns its content-addressed path."""
+        key = self._upload_key(uploaded_file)
+        cached = self._seen.get(key)
+        if cached and os.path.exists(cached):
+            return cached
+
+        ext = os.path.splitext(uploaded_file.name)[1].lower()
+        tmp_path = os.path.join(self.root, f".incoming.{os.getpid()}.{threading.get_ident()}")
+        hasher = hashlib.sha256()
+        uploaded_file.seek(0)
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = uploaded_file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                f.write(chunk)
+        uploaded_file.seek(0)
+
+        path = os.path.join(self.root, f"{hasher.hexdigest()}{ext}")
+        with self._lock:
+            if os.path.exists(path):
+                # Already stored: keep the original so its mtime (and staging fingerprint) stays stable
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+            self._seen[key] = path
+        return path
+
+    def get_columns(self, path: str, loader: Callable[[str], List[str]]) -> List[str]:
+        """Returns the cached schema for a stored file, detecting it with loader on a miss."""
+        schema_path = self._schema_path(self.digest_of(path))
+        cols = self._read_schema(schema_path)
+        if cols is not None:
+            return cols
+        cols = loader(path)
+        if cols:
+            try:
+                with open(schema_path, "w", encoding="utf-8") as f:
+                    json.dump(cols, f)
+            except Exception as e:
+                print(f"Schema cache warning: {e}")
+        return cols
+
+    def _read_schema(self, schema_path: str) -> Optional[List[str]]:
+        if not os.path.exists(schema_path):
+            return None
+        try:
+            with open(schema_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
@@ -1,4 +1,10 @@
+import glob
+import hashlib
 import os
+import zipfile
+
+# Compression suffixes DuckDB's CSV reader decompresses transparently
+COMPRESSION_EXTS = ('.gz', '.zst')
 
 def format_bytes(size):
     """Formats bytes to a human-readable string."""
@@ -28,6 +34,80 @@ def get_file_info(path):
     except Exception:
         return {"size_str": "Error", "ext": "ERR", "modified": 0}
 
+def get_file_fingerprint(path):
+    """
+    Returns a stable hash of path, size and mtime, or None if the file is missing.
+    Directories and glob patterns hash every member file, so adding or changing a part changes it.
+    """
+    if not path or not isinstance(path, str):
+        return None
+    try:
+        if is_dataset(path):
+            files = dataset_files(path)
+            if not files:
+                return None
+        elif os.path.exists(path):
+            files = [path]
+        else:
+            return None
+        keys = []
+        for f in files:
+            stat = os.stat(f)
+            keys.append(f"{os.path.abspath(f)}|{stat.st_size}|{stat.st_mtime_ns}")
+        return hashlib.sha1("\n".join(keys).encode("utf-8")).hexdigest()
+    except Exception:
+        return None
+
+def is_glob(path):
+    return any(c in path for c in "*?[")
+
+def is_dataset(path):
+    """True for multi-file inputs: a directory or a glob pattern."""
+    return bool(path) and (is_glob(path) or os.path.isdir(path))
+
+def dataset_files(path):
+    """
+    Member files of an input, sorted: the file itself, the glob's matches, or every file under
+    a directory (skipping hidden and _-prefixed marker files such as _SUCCESS).
+    """
+    if not path:
+        return []
+    if is_glob(path):
+        return sorted(f for f in glob.glob(path, recursive=True) if os.path.isfile(f))
+    if os.path.isdir(path):
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith((".", "_"))]
+            files.extend(os.path.join(root, n) for n in names if not n.startswith((".", "_")))
+        return sorted(files)
+    return [path] if os.path.isfile(path) else []
+
+def split_compression(path):
+    """('data.csv', '.gz') for 'data.csv.gz'; ('data.csv', '') when uncompressed."""
+    base, ext = os.path.splitext(path)
+    if ext.lower() in COMPRESSION_EXTS:
+        return base, ext.lower()
+    return path, ""
+
+def source_format(path):
+    """
+    (format extension, file suffix) of an input, looking through compression suffixes:
+    'a.tsv.gz' -> ('.tsv', '.tsv.gz'). Directories use their most common member suffix.
+    """
+    name = path
+    if os.path.isdir(path):
+        suffixes = {}
+        for f in dataset_files(path):
+            base, comp = split_compression(f)
+            suffix = os.path.splitext(base)[1].lower() + comp
+            suffixes[suffix] = suffixes.get(suffix, 0) + 1
+        if not suffixes:
+            return "", ""
+        name = "x" + max(suffixes, key=suffixes.get)
+    base, comp = split_compression(name)
+    ext = os.path.splitext(base)[1].lower()
+    return ext, ext + comp
+
 def validate_path(path):
     """Ensures the directory for the path exists."""
     if not path or not isinstance(path, str):
@@ -39,3 +119,44 @@ def validate_path(path):
         return True
     except Exception:
         return False
+
+def is_multi_file_output(write_options):
+    """True when the write options make COPY produce a directory of files."""
+    opts = write_options or {}
+    return bool(opts.get("partition_by") or opts.get("per_thread_output")
+                or opts.get("file_size_bytes") or opts.get("rows_per_file"))
+
+def get_path_size(path):
+    """Size in bytes of a file, or of every file under a directory."""
+    if not path or not os.path.exists(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def zip_output(path, archive=None):
+    """Zips a directory of output parts (streamed file by file) and returns the archive path."""
+    archive = archive or path.rstrip("/\\") + ".zip"
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                zf.write(full, os.path.relpath(full, path))
+    return archive
+
+# Share of physical memory handed to DuckDB when no explicit budget is given
+MEMORY_FRACTION = 0.8
+
+def get_total_memory():
+    """Physical memory in bytes, or None where the platform does not report it."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None